@@ -1,28 +1,34 @@
-from flask import Flask, request, abort
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    ReplyMessageRequest,
-    TextMessage,
-    FlexMessage,
-    FlexContainer,
-)
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, PostbackEvent, FollowEvent
-from linebot.v3.exceptions import InvalidSignatureError
-
-from config import LINE_CHANNEL_SECRET, LINE_CHANNEL_ACCESS_TOKEN
+import base64
+import gc
+import hashlib
+import hmac
+from collections import namedtuple
+from functools import lru_cache
+
+from flask import Flask, Response, request, abort
+
+# LINE SDK（linebot.v3 的 webhook 與 messaging 模型約需 1 秒載入）在第一次使用時才 import，
+# gunicorn worker 啟動後由 warm_imports() 在背景預先載入
+from config import LINE_CHANNEL_SECRET, WEBHOOK_ASYNC
+import crm_store
+import crm_writer
+import event_executor
+import metrics
+import profiler
+import sheets_quota
+import tracing
+from event_dedupe import create_event_dedupe
+from line_client import get_messaging_api
+from questions import QUESTIONS, COMPILED_QUESTIONS, RESULT_LEVELS, MAX_SCORE
 from stress_test import (
     start_test,
     process_answer,
     is_user_in_test,
-    is_multiple_choice_question,
-    get_multiple_selections,
     cancel_test,
-    get_current_question,
+    get_session_stats,
 )
 from user_registration import (
+    user_context,
     is_user_registered,
     is_user_in_registration,
     start_registration,
@@ -31,32 +37,141 @@ from user_registration import (
 )
 from google_sheets import (
     update_test_result,
+    warm_user_index,
+    release_connections,
 )
 
 app = Flask(__name__)
 
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+_parser = None
+
+# 已處理過的 webhookEventId（LINE 重送的事件直接略過）
+event_dedupe = create_event_dedupe()
+
+metrics.register_stats("sessions", get_session_stats, counters=("expired", "evicted"))
+metrics.register_stats("event_executor", event_executor.stats, counters=("processed", "rejected"))
+metrics.register_stats("webhook_dedupe", event_dedupe.stats, counters=("duplicates",))
+metrics.register_stats("sheets_quota", sheets_quota.stats, counters=(
+    "calls", "waited", "wait_seconds", "throttled", "retries", "failures",
+))
+metrics.register_stats("crm_writer", lambda: {"pending": crm_writer.pending_count()})
+metrics.register_stats("crm_store", crm_store.stats)
 
 
 @app.route("/callback", methods=["POST"])
+@metrics.timed("callback")
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
     body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    with metrics.stage("verify_signature"):
+        valid = verify_signature(body, signature)
+    if not valid:
         abort(400)
 
+    with metrics.stage("parse_events"):
+        events = parse_events(body)
+
+    for event in events:
+        event_id = event.webhook_event_id
+        if event_id and not event_dedupe.first_seen(event_id):
+            # 重送的事件已處理過
+            continue
+
+        if WEBHOOK_ASYNC:
+            # 先回 200 給 LINE，事件交給背景執行緒；同一用戶的事件依序處理
+            user_id = getattr(event.source, "user_id", None)
+            if event_executor.submit(user_id, dispatch_event, event):
+                continue
+            # 佇列持續滿載：該用戶較早的事件還在排隊，不能在這裡直接處理（會打亂順序），
+            # 回 503 讓 LINE 重送；已排入的事件重送時由去重略過
+            if event_id:
+                event_dedupe.forget(event_id)
+            abort(503)
+
+        try:
+            dispatch_event(event)
+        except Exception:
+            # 回應失敗時 LINE 會重送，讓重送的事件可以再處理一次
+            if event_id:
+                event_dedupe.forget(event_id)
+            raise
+
     return "OK"
 
 
+def verify_signature(body, signature):
+    """驗證 X-Line-Signature（與 linebot SignatureValidator 相同：HMAC-SHA256 後 base64）"""
+    digest = hmac.new(LINE_CHANNEL_SECRET.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return hmac.compare_digest(signature.encode("utf-8"), base64.b64encode(digest))
+
+
+def parse_events(body):
+    """解析已驗證簽章的 webhook 內容"""
+    global _parser
+    if _parser is None:
+        from linebot.v3 import WebhookParser
+        # 簽章已由 verify_signature 驗證，分開記錄驗證與解析的時間
+        _parser = WebhookParser(LINE_CHANNEL_SECRET, skip_signature_verification=lambda: True)
+    return _parser.parse(body, "")
+
+
+def warm_imports():
+    """預先載入 LINE SDK，第一個事件不必等待 import"""
+    parse_events('{"events": []}')
+    get_messaging_api()
+
+
+def preload():
+    """gunicorn preload 時在 master fork 前執行：建立所有共用的唯讀狀態，worker 以 copy-on-write 共用
+
+    載入 LINE SDK、建立並驗證所有 Flex 卡片範本、讀取用戶索引（不啟動背景執行緒），
+    最後關閉連線並以 gc.freeze() 將這些物件移出 GC 追蹤，worker 的 GC 不會寫入這些分頁。
+    """
+    gc.disable()
+    try:
+        parse_events('{"events": []}')
+        warm_flex_cache()
+        warm_result_templates()
+        users = warm_user_index(start_threads=False)
+        release_connections()
+    finally:
+        gc.freeze()
+        gc.enable()
+    return users
+
+
 @app.route("/health", methods=["GET"])
 def health_check():
     return "OK"
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus 格式的各階段處理時間與計數"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def profile_endpoint():
+    """POST 開始取樣（?seconds=30），GET 取得最近一次完成的 folded stacks（需 PROFILER_ADMIN_TOKEN）"""
+    if not profiler.authorized(request.headers.get("Authorization", "")):
+        abort(404)
+
+    if request.method == "POST":
+        seconds = request.args.get("seconds", type=float) or profiler.PROFILER_WINDOW_SECONDS
+        if not profiler.start(seconds):
+            return profiler.status(), 409
+        return profiler.status(), 202
+
+    status = profiler.status()
+    output = profiler.last_output()
+    if output is None:
+        return status, 202 if status["running"] else 404
+    return Response(output, content_type="text/plain; charset=utf-8",
+                    headers={"X-Profile-Path": status["last_output"]})
+
+
 def create_button_box(label, data, use_postback=False):
     """建立單一按鈕框"""
     if use_postback:
@@ -94,8 +209,11 @@ def create_button_box(label, data, use_postback=False):
     }
 
 
+@metrics.timed("flex_question")
 def create_question_flex(question, show_part=False):
     """建立問題的 Flex Message"""
+    from linebot.v3.messaging import FlexMessage, FlexContainer
+
     options = question["options"]
     is_multiple = question.get("type") == "multiple"
 
@@ -170,8 +288,11 @@ def create_question_flex(question, show_part=False):
     )
 
 
+@metrics.timed("flex_multiple")
 def create_multiple_continue_flex(question, selected):
     """建立多選題繼續選擇的 Flex Message（已選項目會反色顯示）"""
+    from linebot.v3.messaging import FlexMessage, FlexContainer
+
     options = question["options"]
 
     # 建立選項按鈕（已選的反色顯示）
@@ -268,8 +389,37 @@ def create_multiple_continue_flex(question, selected):
     )
 
 
-def create_result_flex(result):
-    """建立測試結果的 Flex Message"""
+def get_question_flex(question_index, show_part=False):
+    """取得題目卡片（每題、每種 show_part 只建立並驗證一次）"""
+    # 以固定的位置參數查快取：位置與關鍵字參數在 lru_cache 中是不同的 key
+    return _question_flex(question_index, bool(show_part))
+
+
+@lru_cache(maxsize=None)
+def _question_flex(question_index, show_part):
+    return create_question_flex(QUESTIONS[question_index], show_part=show_part)
+
+
+@lru_cache(maxsize=None)
+def get_multiple_continue_flex(question_index, mask):
+    """取得多選題已選狀態的卡片（每種選擇組合只建立並驗證一次）"""
+    compiled = COMPILED_QUESTIONS[question_index]
+    selected = compiled.selections[mask] if compiled.is_multiple else ()
+    return create_multiple_continue_flex(compiled.question, selected)
+
+
+def warm_flex_cache():
+    """預先建立所有題目卡片與多選題的所有選擇組合"""
+    for compiled in COMPILED_QUESTIONS:
+        get_question_flex(compiled.index, show_part=False)
+        get_question_flex(compiled.index, show_part=True)
+        if compiled.is_multiple:
+            for mask in range(len(compiled.selections)):
+                get_multiple_continue_flex(compiled.index, mask)
+
+
+def build_result_flex_content(result):
+    """建立測試結果卡片的 dict 結構"""
     profile = result.get("profile", {})
 
     # 根據等級選擇顏色
@@ -450,7 +600,7 @@ def create_result_flex(result):
         "borderWidth": "normal"
     })
 
-    flex_content = {
+    return {
         "type": "bubble",
         "size": "giga",
         "body": {
@@ -462,19 +612,126 @@ def create_result_flex(result):
         }
     }
 
+
+# 結果卡片範本中待替換的欄位標記
+_SLOT = "\x00{}\x00"
+
+ResultTemplate = namedtuple("ResultTemplate", [
+    "bubble",     # 已驗證的 FlexBubble
+    "head",       # 標題到專家建議的固定節點（含分數節點）
+    "score_at",   # 分數節點在 head 中的位置
+    "separator",  # 背景資訊前的分隔線
+    "q5",         # 理財挑戰
+    "q7",         # 年度理財預算
+    "q8",         # 最想解決的問題
+    "buttons",    # 秘笈與重新測試按鈕
+])
+
+
+@lru_cache(maxsize=None)
+def get_result_template(level, description, suggestion, max_score):
+    """取得結果等級的卡片範本（每個等級只建立並驗證一次）"""
+    from linebot.v3.messaging import FlexContainer
+
+    sample = {
+        "level": level,
+        "description": description,
+        "suggestion": suggestion,
+        "score": _SLOT.format("score"),
+        "max_score": max_score,
+        "profile": {
+            "Q5": [_SLOT.format("Q5")],
+            "Q7": _SLOT.format("Q7"),
+            "Q8": _SLOT.format("Q8"),
+        },
+    }
+    bubble = FlexContainer.from_dict(build_result_flex_content(sample))
+    contents = bubble.body.contents
+
+    # 以標記找出各欄位節點的位置
+    slots = {}
+    for i, node in enumerate(contents):
+        for name in ("score", "Q5", "Q7", "Q8"):
+            if _SLOT.format(name) in (getattr(node, "text", None) or ""):
+                slots[name] = i
+
+    return ResultTemplate(
+        bubble=bubble,
+        head=tuple(contents[:slots["Q5"] - 1]),
+        score_at=slots["score"],
+        separator=contents[slots["Q5"] - 1],
+        q5=contents[slots["Q5"]],
+        q7=contents[slots["Q7"]],
+        q8=contents[slots["Q8"]],
+        buttons=tuple(contents[slots["Q8"] + 1:]),
+    )
+
+
+def warm_result_templates():
+    """預先建立所有結果等級的卡片範本"""
+    for _, level, description, suggestion in RESULT_LEVELS:
+        get_result_template(level, description, suggestion, MAX_SCORE)
+
+
+def _fill_slot(node, name, value):
+    """複製範本節點並填入欄位值（不重新驗證）"""
+    return node.copy(update={"text": node.text.replace(_SLOT.format(name), str(value))})
+
+
+@metrics.timed("flex_result")
+def create_result_flex(result):
+    """建立測試結果的 Flex Message（套用已驗證的等級範本，只替換分數與背景資訊）"""
+    from linebot.v3.messaging import FlexMessage
+
+    template = get_result_template(
+        result["level"], result["description"], result["suggestion"], result["max_score"]
+    )
+    profile = result.get("profile", {})
+
+    contents = list(template.head)
+    contents[template.score_at] = _fill_slot(contents[template.score_at], "score", result["score"])
+
+    # 加入用戶背景資訊
+    if profile.get("Q5") or profile.get("Q7") or profile.get("Q8"):
+        contents.append(template.separator)
+
+        challenges = profile.get("Q5")
+        if isinstance(challenges, list) and challenges:
+            contents.append(_fill_slot(template.q5, "Q5", ", ".join(challenges)))
+        if profile.get("Q7"):
+            contents.append(_fill_slot(template.q7, "Q7", profile["Q7"]))
+        if profile.get("Q8"):
+            contents.append(_fill_slot(template.q8, "Q8", profile["Q8"]))
+
+    contents.extend(template.buttons)
+
+    body = template.bubble.body.copy(update={"contents": contents})
     return FlexMessage(
         alt_text=f"測試結果：{result['level']}",
-        contents=FlexContainer.from_dict(flex_content)
+        contents=template.bubble.copy(update={"body": body})
     )
 
 
-@handler.add(FollowEvent)
+@metrics.timed("dispatch_event")
+def dispatch_event(event):
+    """將事件交給對應的處理函式（TRACING_ENABLED 時每個事件一個 trace）"""
+    with tracing.trace_event(event):
+        if event.type == "follow":
+            handle_follow(event)
+        elif event.type == "message" and event.message.type == "text":
+            handle_text_message(event)
+        elif event.type == "postback":
+            handle_postback(event)
+
+
 def handle_follow(event):
     """處理用戶加入好友事件"""
+    from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+
     user_id = event.source.user_id
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+    with user_context(user_id):
+        line_bot_api = get_messaging_api()
 
         # 開始註冊流程
         result = start_registration(user_id)
@@ -504,13 +761,14 @@ def handle_follow(event):
             )
 
 
-@handler.add(MessageEvent, message=TextMessageContent)
 def handle_text_message(event):
+    from linebot.v3.messaging import ReplyMessageRequest, TextMessage, FlexMessage, FlexContainer
+
     user_id = event.source.user_id
     user_message = event.message.text.strip()
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+    with user_context(user_id):
+        line_bot_api = get_messaging_api()
 
         # 檢查是否在註冊流程中
         if is_user_in_registration(user_id):
@@ -578,7 +836,7 @@ def handle_text_message(event):
             if is_user_in_test(user_id):
                 cancel_test(user_id)
 
-            question = start_test(user_id)
+            start_test(user_id)
 
             intro_message = TextMessage(
                 text="📋 VIP 財富健康體檢表\n\n"
@@ -587,7 +845,7 @@ def handle_text_message(event):
                      "完成後將為您分析財務健康狀況並提供專家建議。\n\n"
                      "讓我們開始吧！"
             )
-            question_message = create_question_flex(question, show_part=True)
+            question_message = get_question_flex(0, show_part=True)
 
             line_bot_api.reply_message(
                 ReplyMessageRequest(
@@ -621,16 +879,16 @@ def handle_text_message(event):
             status, data = process_answer(user_id, user_message)
 
             if status == "invalid":
-                current_question = get_current_question(user_id)
-                if is_multiple_choice_question(user_id):
-                    selected = get_multiple_selections(user_id)
-                    if selected:
+                current_index = data["index"]
+                if COMPILED_QUESTIONS[current_index].is_multiple:
+                    mask = data["mask"]
+                    if mask:
                         line_bot_api.reply_message(
                             ReplyMessageRequest(
                                 reply_token=event.reply_token,
                                 messages=[
                                     TextMessage(text="請選擇選項或按「完成選擇」。"),
-                                    create_multiple_continue_flex(current_question, selected)
+                                    get_multiple_continue_flex(current_index, mask)
                                 ]
                             )
                         )
@@ -640,7 +898,7 @@ def handle_text_message(event):
                                 reply_token=event.reply_token,
                                 messages=[
                                     TextMessage(text="請點選下方選項。"),
-                                    create_question_flex(current_question)
+                                    get_question_flex(current_index)
                                 ]
                             )
                         )
@@ -650,7 +908,7 @@ def handle_text_message(event):
                             reply_token=event.reply_token,
                             messages=[
                                 TextMessage(text="請點選下方選項。"),
-                                create_question_flex(current_question)
+                                get_question_flex(current_index)
                             ]
                         )
                     )
@@ -658,17 +916,16 @@ def handle_text_message(event):
                 line_bot_api.reply_message(
                     ReplyMessageRequest(
                         reply_token=event.reply_token,
-                        messages=[create_multiple_continue_flex(data["question"], data["selected"])]
+                        messages=[get_multiple_continue_flex(data["index"], data["mask"])]
                     )
                 )
             elif status == "next":
-                prev_index = user_sessions_get_prev_index(user_id)
-                show_part = should_show_part(prev_index, data)
+                show_part = should_show_part(data["index"] - 1, data["question"])
 
                 line_bot_api.reply_message(
                     ReplyMessageRequest(
                         reply_token=event.reply_token,
-                        messages=[create_question_flex(data, show_part=show_part)]
+                        messages=[get_question_flex(data["index"], show_part=show_part)]
                     )
                 )
             elif status == "complete":
@@ -697,101 +954,87 @@ def handle_text_message(event):
         )
 
 
-def user_sessions_get_prev_index(user_id):
-    """取得上一題的索引"""
-    from stress_test import user_sessions
-    session = user_sessions.get(user_id)
-    if session:
-        return session["current_question"] - 1
-    return -1
-
-
 def should_show_part(prev_index, current_question):
-    """判斷是否需要顯示 part 標題"""
-    from questions import QUESTIONS
+    """判斷是否需要顯示 part 標題（current_question 為 prev_index 的下一題）"""
     if prev_index < 0:
         return True
-    if prev_index >= len(QUESTIONS):
+    if prev_index + 1 >= len(COMPILED_QUESTIONS):
         return False
-    prev_part = QUESTIONS[prev_index].get("part", "")
-    current_part = current_question.get("part", "")
-    return prev_part != current_part
+    return COMPILED_QUESTIONS[prev_index + 1].show_part
 
 
-@handler.add(PostbackEvent)
 def handle_postback(event):
     """處理 postback 事件（多選題用）"""
+    from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+
     user_id = event.source.user_id
     postback_data = event.postback.data
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+    line_bot_api = get_messaging_api()
 
-        # 檢查是否在測試中
-        if not is_user_in_test(user_id):
-            return
+    # 檢查是否在測試中
+    if not is_user_in_test(user_id):
+        return
 
-        # 處理「完成選擇」
-        if postback_data == "complete_multiple":
-            status, data = process_answer(user_id, "完成")
+    # 處理「完成選擇」
+    if postback_data == "complete_multiple":
+        status, data = process_answer(user_id, "完成")
 
-            if status == "need_selection":
-                # 用戶還沒選擇任何選項，提示並重新顯示題目
-                line_bot_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[
-                            TextMessage(text="請至少選擇一個選項"),
-                            create_question_flex(data)
-                        ]
-                    )
-                )
-            elif status == "next":
-                prev_index = user_sessions_get_prev_index(user_id)
-                show_part = should_show_part(prev_index, data)
-                line_bot_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[create_question_flex(data, show_part=show_part)]
-                    )
-                )
-            elif status == "complete":
-                # 更新 Google Sheets 測試結果
-                update_test_result(user_id, data['score'], data['level'])
-
-                line_bot_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[create_result_flex(data)]
-                    )
+        if status == "need_selection":
+            # 用戶還沒選擇任何選項，提示並重新顯示題目
+            line_bot_api.reply_message(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[
+                        TextMessage(text="請至少選擇一個選項"),
+                        get_question_flex(data["index"])
+                    ]
                 )
-            return
-
-        # 處理選項選擇（toggle:A, toggle:B 等，或直接是 A, B, C, D）
-        if postback_data.startswith("toggle:"):
-            answer = postback_data.split(":")[1]
-        else:
-            answer = postback_data
-
-        status, data = process_answer(user_id, answer)
-
-        if status == "multiple_continue":
+            )
+        elif status == "next":
+            show_part = should_show_part(data["index"] - 1, data["question"])
             line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[create_multiple_continue_flex(data["question"], data["selected"])]
+                    messages=[get_question_flex(data["index"], show_part=show_part)]
                 )
             )
-        elif status == "invalid":
-            current_question = get_current_question(user_id)
-            selected = get_multiple_selections(user_id)
+        elif status == "complete":
+            # 更新 Google Sheets 測試結果
+            update_test_result(user_id, data['score'], data['level'])
+
             line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[create_multiple_continue_flex(current_question, selected)]
+                    messages=[create_result_flex(data)]
                 )
             )
+        return
+
+    # 處理選項選擇（toggle:A, toggle:B 等，或直接是 A, B, C, D）
+    if postback_data.startswith("toggle:"):
+        answer = postback_data.split(":")[1]
+    else:
+        answer = postback_data
+
+    status, data = process_answer(user_id, answer)
+
+    if status == "multiple_continue":
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[get_multiple_continue_flex(data["index"], data["mask"])]
+            )
+        )
+    elif status == "invalid":
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[get_multiple_continue_flex(data["index"], data["mask"])]
+            )
+        )
 
 
 if __name__ == "__main__":
+    profiler.start_from_env()
     app.run(host="0.0.0.0", port=8080, debug=True)
@@ -0,0 +1,154 @@
+"""啟動時間基準測試：import app 的總時間與各模組成本
+
+每次在新的 process 以 python -X importtime 載入 app，重複多次取中位數，輸出：
+- import app 的總時間，以及 warm_imports()（延後到背景或第一個事件的 LINE SDK）的時間
+- 本專案每個模組的成本（self：模組本身；cumulative：含它第一次載入的相依套件）
+- 依最上層套件合計的第三方套件成本
+
+結果存成 JSON；指定 --baseline 時與先前結果比較，--budget-ms 超過時回傳非 0。
+
+用法：
+  python benchmarks/bench_import.py [--runs 7] [--output benchmarks/import_baseline.json]
+                                    [--baseline benchmarks/import_baseline.json] [--budget-ms 400]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_MODULES = {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+PROBE = """
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.warm_imports()
+warmed = time.perf_counter()
+print(f"{(imported - started) * 1000:.3f} {(warmed - imported) * 1000:.3f}")
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=10, help="列出成本最高的幾個第三方套件")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "import_baseline.json"))
+    parser.add_argument("--baseline", help="與此 JSON 結果比較")
+    parser.add_argument("--budget-ms", type=float, help="import app 的中位數超過此值時回傳 1")
+    return parser.parse_args()
+
+
+def run_once():
+    """在新的 process 載入 app，回傳 (import 毫秒, warm_imports 毫秒, {模組: (self 毫秒, cumulative 毫秒)})"""
+    env = dict(os.environ)
+    env.setdefault("LINE_CHANNEL_SECRET", "benchmark-secret")
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark-token")
+    env["SHEETS_BACKEND"] = "fake"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+
+    # 每行「import time: self [us] | cumulative | 模組」，子模組先於父模組輸出，縮排表示層級；
+    # 只取 app 這棵樹（前一個最上層模組之後到 app 為止），之後 warm_imports() 載入的不算
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, field = line[len("import time:"):].split("|")
+        name = field.strip()
+        modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        if len(field) - len(field.lstrip()) == 1:
+            if name == "app":
+                break
+            modules = {}
+    import_ms, warm_ms = (float(value) for value in completed.stdout.split())
+    return import_ms, warm_ms, modules
+
+
+def measure(args):
+    import_times, warm_times, runs = [], [], []
+    for _ in range(args.runs):
+        import_ms, warm_ms, modules = run_once()
+        import_times.append(import_ms)
+        warm_times.append(warm_ms)
+        runs.append(modules)
+
+    names = {name for run in runs for name in run}
+    local, packages = {}, {}
+    for name in names:
+        self_ms = statistics.median(run.get(name, (0, 0))[0] for run in runs)
+        cumulative_ms = statistics.median(run.get(name, (0, 0))[1] for run in runs)
+        top = name.split(".")[0]
+        if top in LOCAL_MODULES:
+            local[name] = {"self_ms": round(self_ms, 2), "cumulative_ms": round(cumulative_ms, 2)}
+        else:
+            packages[top] = round(packages.get(top, 0.0) + self_ms, 2)
+
+    return {
+        "meta": {
+            "runs": args.runs,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "import_app_ms": round(statistics.median(import_times), 1),
+        "warm_imports_ms": round(statistics.median(warm_times), 1),
+        "local_modules": dict(sorted(local.items(), key=lambda item: -item[1]["cumulative_ms"])),
+        "packages_ms": dict(sorted(packages.items(), key=lambda item: -item[1])),
+    }
+
+
+def _delta(value, base):
+    return f"  ({(value / base - 1) * 100:+.1f}%)" if base else ""
+
+
+def print_report(result, baseline, top):
+    base = baseline or {}
+    print(f"import app：{result['import_app_ms']} ms{_delta(result['import_app_ms'], base.get('import_app_ms'))}"
+          f"（中位數，{result['meta']['runs']} 次）")
+    print(f"warm_imports()：{result['warm_imports_ms']} ms"
+          f"{_delta(result['warm_imports_ms'], base.get('warm_imports_ms'))}（背景或第一個事件載入）")
+
+    print(f"\n{'module':<24}{'self ms':>10}{'cumul ms':>10}")
+    base_local = base.get("local_modules", {})
+    for name, stats in result["local_modules"].items():
+        previous = base_local.get(name, {}).get("cumulative_ms")
+        print(f"{name:<24}{stats['self_ms']:>10.2f}{stats['cumulative_ms']:>10.2f}"
+              f"{_delta(stats['cumulative_ms'], previous)}")
+
+    print(f"\n{'package':<24}{'self ms':>10}")
+    base_packages = base.get("packages_ms", {})
+    for name, self_ms in list(result["packages_ms"].items())[:top]:
+        print(f"{name:<24}{self_ms:>10.2f}{_delta(self_ms, base_packages.get(name))}")
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    result = measure(args)
+    print_report(result, baseline, args.top)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"\n結果已寫入 {args.output}")
+
+    if args.budget_ms is not None and result["import_app_ms"] > args.budget_ms:
+        print(f"import app 超過預算 {args.budget_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
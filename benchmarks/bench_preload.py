@@ -0,0 +1,210 @@
+"""gunicorn preload 的記憶體基準測試：每個 worker 的常駐記憶體
+
+分別以 GUNICORN_PRELOAD=0 / 1 啟動 gunicorn（假工作表預先放入 --rows 位用戶），
+等 worker 載入完成後以 benchmarks/loadgen.py 送一段流量（--traffic-seconds 0 為不送），
+再從 /proc/<pid>/smaps_rollup 讀取 master 與每個 worker 的記憶體：
+- RSS：常駐記憶體（共用的分頁在每個 process 都算一次）
+- PSS：共用分頁依共用的 process 數均分，所有 process 加總即實際用量
+- Private：只屬於該 process 的分頁（fork 後被寫入而複製的分頁也算在這裡）
+
+假工作表的資料也存在 master，preload 時同樣由 worker 共用；正式環境沒有這一份。
+只能在 Linux 上執行。
+
+用法：
+  python benchmarks/bench_preload.py [--workers 4] [--rows 20000] [--traffic-seconds 10]
+                                     [--output preload.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "benchmark-secret"
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=20000, help="假工作表預先放入的用戶數")
+    parser.add_argument("--settle", type=float, default=5.0, help="worker 回應後等待背景載入的秒數")
+    parser.add_argument("--traffic-seconds", type=float, default=10.0, help="量測前送流量的秒數")
+    parser.add_argument("--rate", type=float, default=20.0, help="流量的事件/秒")
+    parser.add_argument("--timeout", type=float, default=120.0, help="等待服務啟動的秒數上限")
+    parser.add_argument("--output", help="將結果寫入 JSON")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(port, timeout):
+    """等待 /health 回 200，回傳等待的秒數"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"服務在 {timeout} 秒內沒有回應")
+
+
+def children(pid):
+    """pid 的子 process（由 /proc/*/stat 的 ppid 找出）"""
+    found = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 第 2 欄（指令名稱）可能含空白，從最後一個 ")" 之後開始取
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            found.append(int(name))
+    return sorted(found)
+
+
+def memory(pid):
+    """smaps_rollup 中的 RSS、PSS 與 Private（KiB）"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in FIELDS:
+                values[key] = int(rest.split()[0])
+    return {
+        "rss_kb": values["Rss"],
+        "pss_kb": values["Pss"],
+        "private_kb": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def run(args, preload, workdir):
+    """啟動一次 gunicorn 並量測，回傳結果 dict"""
+    port, stub_port = free_port(), free_port()
+    env = dict(os.environ)
+    env.update({
+        "GUNICORN_PRELOAD": "1" if preload else "0",
+        "WEB_CONCURRENCY": str(args.workers),
+        "LINE_CHANNEL_SECRET": SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "benchmark-token",
+        "LINE_API_HOST": f"http://127.0.0.1:{stub_port}",
+        "SHEETS_BACKEND": "fake",
+        "FAKE_SHEETS_ROWS": str(args.rows),
+        "FAKE_SHEETS_LATENCY": "0",
+        "FAKE_SHEETS_JITTER": "0",
+        "SESSION_BACKEND": "sqlite",
+        "SESSION_DB_PATH": os.path.join(workdir, f"sessions_{int(preload)}.db"),
+        "CRM_DB_PATH": os.path.join(workdir, f"crm_{int(preload)}.db"),
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        ready_seconds = wait_healthy(port, args.timeout)
+        time.sleep(args.settle)
+        workers = children(server.pid)
+        if len(workers) != args.workers:
+            raise RuntimeError(f"預期 {args.workers} 個 worker，實際 {len(workers)} 個")
+
+        if args.traffic_seconds > 0:
+            subprocess.run(
+                [sys.executable, os.path.join(ROOT, "benchmarks", "loadgen.py"),
+                 "--url", f"http://127.0.0.1:{port}/callback", "--secret", SECRET,
+                 "--line-stub-port", str(stub_port), "--users", "500", "--think-time", "1",
+                 "--rates", str(args.rate), "--step-seconds", str(args.traffic_seconds), "--seed", "1"],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True,
+            )
+
+        worker_memory = [memory(pid) for pid in workers]
+        master_memory = memory(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        stderr = server.stderr.read().decode("utf-8", "replace")
+
+    preload_line = next((line for line in stderr.splitlines() if "preload 完成" in line), None)
+    return {
+        "preload": preload,
+        "ready_seconds": round(ready_seconds, 2),
+        "preload_log": preload_line.split("] ")[-1] if preload_line else None,
+        "master": master_memory,
+        "workers": worker_memory,
+        "worker_avg": {
+            key: round(sum(item[key] for item in worker_memory) / len(worker_memory))
+            for key in ("rss_kb", "pss_kb", "private_kb")
+        },
+        "total_pss_kb": master_memory["pss_kb"] + sum(item["pss_kb"] for item in worker_memory),
+    }
+
+
+def _mb(kb):
+    return f"{kb / 1024:8.1f}"
+
+
+def print_report(results):
+    print(f"{'':<12}{'ready s':>9}{'worker RSS':>12}{'worker PSS':>12}{'private':>10}"
+          f"{'master PSS':>12}{'total PSS':>11}   (MiB)")
+    for result in results:
+        avg = result["worker_avg"]
+        label = "preload" if result["preload"] else "no preload"
+        print(f"{label:<12}{result['ready_seconds']:>9.2f}{_mb(avg['rss_kb']):>12}{_mb(avg['pss_kb']):>12}"
+              f"{_mb(avg['private_kb']):>10}{_mb(result['master']['pss_kb']):>12}{_mb(result['total_pss_kb']):>11}")
+    for result in results:
+        if result["preload_log"]:
+            print(result["preload_log"])
+
+    base, preloaded = results
+    saved = base["total_pss_kb"] - preloaded["total_pss_kb"]
+    print(f"\npreload 共節省 {saved / 1024:.1f} MiB PSS（{saved / base['total_pss_kb'] * 100:.1f}%），"
+          f"每個 worker 私有記憶體 {_mb(base['worker_avg']['private_kb']).strip()} → "
+          f"{_mb(preloaded['worker_avg']['private_kb']).strip()} MiB")
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [run(args, False, workdir), run(args, True, workdir)]
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "workers": args.workers,
+                    "rows": args.rows,
+                    "traffic_seconds": args.traffic_seconds,
+                    "rate": args.rate,
+                    "python": platform.python_version(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n結果已寫入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""結果卡片產生成本：每次重建並驗證 dict vs 套用等級範本
+
+用法：python benchmarks/bench_result_flex.py [次數]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot.v3.messaging import FlexMessage, FlexContainer, ReplyMessageRequest  # noqa: E402
+
+from app import build_result_flex_content, create_result_flex  # noqa: E402
+from questions import RESULT_LEVELS, MAX_SCORE  # noqa: E402
+
+
+def sample_results():
+    """三個等級各一份完成測試的結果"""
+    return [
+        {
+            "score": threshold + 2,
+            "max_score": MAX_SCORE,
+            "level": level,
+            "description": description,
+            "suggestion": suggestion,
+            "profile": {
+                "Q5": ["工作太忙沒時間", "不知道怎麼選標的"],
+                "Q7": "10-50萬",
+                "Q8": "建立穩定的被動收入",
+            },
+        }
+        for threshold, level, description, suggestion in RESULT_LEVELS
+    ]
+
+
+def rebuild(result):
+    """舊做法：每次建立 dict 並以 FlexContainer.from_dict 驗證"""
+    return FlexMessage(
+        alt_text=f"測試結果：{result['level']}",
+        contents=FlexContainer.from_dict(build_result_flex_content(result))
+    )
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = sample_results()
+
+    for result in results:
+        # 兩種做法產生的內容必須完全相同
+        assert rebuild(result).to_dict() == create_result_flex(result).to_dict()
+
+    def run(render):
+        for result in results:
+            render(result)
+
+    print(f"每次產生結果卡片（{number} 次 × {len(results)} 個等級）")
+    for name, render in (("重建 + 驗證", rebuild), ("等級範本", create_result_flex)):
+        seconds = min(timeit.repeat(lambda: run(render), number=number, repeat=3))
+        print(f"  {name:8} {seconds / (number * len(results)) * 1e6:8.1f} µs")
+
+    # 含序列化成送出的 JSON（reply_message 實際要做的事）
+    for name, render in (("重建 + 驗證", rebuild), ("等級範本", create_result_flex)):
+        seconds = min(timeit.repeat(
+            lambda: [
+                ReplyMessageRequest(reply_token="x", messages=[render(result)]).to_json()
+                for result in results
+            ],
+            number=number // 4 or 1, repeat=3,
+        ))
+        print(f"  {name:8} + to_json {seconds / ((number // 4 or 1) * len(results)) * 1e6:8.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""測試進度記憶體用量比較：舊的 dict 結構 vs SessionState
+
+用法：python benchmarks/bench_session_memory.py [session 數量]
+"""
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stress_test import SessionState  # noqa: E402
+
+
+def make_dict_session(i):
+    """舊版 start_test 的 dict 結構（作答到 Q6 的狀態）"""
+    return {
+        "current_question": 5,
+        "answers": ["A", "B", "C", "B", ["工作太忙沒時間", "不知道怎麼選標的"]],
+        "score": 12 + i % 10,
+        "profile": {"Q5": ["工作太忙沒時間", "不知道怎麼選標的"]},
+        "multi_answers": []
+    }
+
+
+def make_compact_session(i):
+    """相同狀態的 SessionState"""
+    session = SessionState(current_question=5, score=12 + i % 10)
+    session.answers[:5] = bytes((0, 1, 2, 1, 0b0101))
+    return session
+
+
+def measure(factory, count):
+    """建立 count 個 session，回傳平均每個佔用的 bytes（含 list 的 8 B 指標）"""
+    tracemalloc.start()
+    sessions = [factory(i) for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return used / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    dict_bytes = measure(make_dict_session, count)
+    compact_bytes = measure(make_compact_session, count)
+
+    dict_serialized = len(json.dumps(make_dict_session(0), ensure_ascii=False).encode("utf-8"))
+    compact_serialized = len(make_compact_session(0).to_bytes())
+
+    print(f"session 數量：{count}")
+    print(f"{'':12}{'記憶體/筆':>12}{'序列化/筆':>12}")
+    print(f"{'dict':12}{dict_bytes:>10.0f} B{dict_serialized:>10} B")
+    print(f"{'SessionState':12}{compact_bytes:>10.0f} B{compact_serialized:>10} B")
+    print(f"記憶體減少 {dict_bytes / compact_bytes:.1f} 倍，序列化減少 {dict_serialized / compact_serialized:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""用戶索引載入比較：get_all_values + 每位用戶一個 list vs 分段讀取的欄式表
+
+以假的工作表模擬 API 回應（每次讀取都重新解碼 JSON，與 gspread 相同產生新的字串物件）。
+
+用法：python benchmarks/bench_user_index.py [列數] [每段列數]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google_sheets  # noqa: E402
+from google_sheets import _pad_row, _new_table, _read_rows  # noqa: E402
+from gspread.utils import a1_to_rowcol  # noqa: E402
+
+LEVELS = ("🟢 綠燈：財務體質良好", "🟡 黃燈：需要調整", "🔴 紅燈：需要立即行動")
+
+
+def make_rows(count):
+    """產生 count 位用戶的工作表（含標題列），約三成已完成測試"""
+    rows = [["Line ID", "姓名", "註冊時間", "測試分數", "測試等級", "測試時間", "客戶狀態", "備註"]]
+    for i in range(count):
+        row = [f"U{i:032x}", f"用戶{i}", f"2026/0{1 + i % 9}/{10 + i % 18} {i % 24:02d}:{i % 60:02d}"]
+        if i % 3 == 0:
+            score = 5 + i % 38
+            row += [str(score), LEVELS[i % 3], row[2], "待追蹤"]
+        else:
+            row += ["", "", "", "待追蹤"]
+        rows.append(row)
+    return rows
+
+
+class FakeWorksheet:
+    """只實作載入用到的 get_all_values 與 get"""
+
+    def __init__(self, rows):
+        self._encoded = [json.dumps(row, ensure_ascii=False) for row in rows]
+        self.calls = 0
+
+    def _decode(self, encoded):
+        self.calls += 1
+        return json.loads("[" + ",".join(encoded) + "]")
+
+    def get_all_values(self):
+        return self._decode(self._encoded)
+
+    def get(self, cell_range):
+        start, end = (a1_to_rowcol(part)[0] for part in cell_range.split(":"))
+        return self._decode(self._encoded[start - 1:end])
+
+
+def load_dict(sheet):
+    """舊版索引：一次讀取整張表，user_id -> [列號, 列資料]（略過標題列）"""
+    index = {}
+    for row_number, row in enumerate(sheet.get_all_values()[1:], start=2):
+        if row and row[0]:
+            index.setdefault(row[0], [row_number, _pad_row(row)])
+    return index
+
+
+def load_table(sheet):
+    """分段讀取到欄式表"""
+    table = _new_table()
+    _read_rows(sheet, table)
+    return table
+
+
+def measure(loader, sheet):
+    """回傳 (秒數, 載入過程最高記憶體, 載入後保留的記憶體, API 呼叫次數)"""
+    sheet.calls = 0
+    started = time.perf_counter()
+    index = loader(sheet)
+    elapsed = time.perf_counter() - started
+    calls = sheet.calls
+    del index
+
+    # 另外量記憶體（tracemalloc 會拖慢速度，不與計時同時進行）
+    tracemalloc.start()
+    index = loader(sheet)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(index) == len(sheet._encoded) - 1
+    del index
+    return elapsed, peak, retained, calls
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if len(sys.argv) > 2:
+        google_sheets.CRM_INDEX_LOAD_CHUNK = int(sys.argv[2])
+
+    sheet = FakeWorksheet(make_rows(count))
+    print(f"{count} 列，每段 {google_sheets.CRM_INDEX_LOAD_CHUNK} 列")
+    for name, loader in (("get_all_values+dict", load_dict), ("chunked+columnar", load_table)):
+        elapsed, peak, retained, calls = measure(loader, sheet)
+        print(f"{name:<20} {elapsed:6.2f} s  最高 {peak / 2**20:7.1f} MiB  "
+              f"保留 {retained / 2**20:7.1f} MiB  ({retained / count:.0f} B/用戶, {calls} 次讀取)")
+
+
+if __name__ == "__main__":
+    main()
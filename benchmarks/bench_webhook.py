@@ -0,0 +1,248 @@
+"""webhook 端到端延遲基準測試
+
+以 LINE_CHANNEL_SECRET 簽章合成的 webhook，經 Flask test client 打 /callback，
+每位用戶走完整流程：加入好友 → 輸入姓名 → 開始測試 → 8 題（Q5 多選含取消勾選）→ 結果。
+LINE 回覆為空殼（可加延遲），Google Sheets 使用 fake_sheets（SHEETS_BACKEND=fake）。
+
+依事件類型輸出 p50 / p95 / p99 延遲與吞吐量，指定 --output 時存成 JSON；
+指定 --baseline 時與先前的結果比較（不會覆寫 baseline）。
+更新 baseline：python benchmarks/bench_webhook.py --output benchmarks/webhook_baseline.json
+
+用法：
+  python benchmarks/bench_webhook.py [--users 200] [--sheets-latency 0] [--reply-latency 0]
+                                     [--output result.json]
+                                     [--baseline benchmarks/webhook_baseline.json]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EVENT_TYPES = ("follow", "register", "start_test", "answer", "toggle", "complete_multiple", "result")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="假工作表每次請求的秒數")
+    parser.add_argument("--reply-latency", type=float, default=0.0, help="LINE 回覆的秒數")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="將結果寫入 JSON")
+    parser.add_argument("--baseline", help="與此 JSON 結果比較")
+    args = parser.parse_args()
+    if (args.output and args.baseline
+            and os.path.abspath(args.output) == os.path.abspath(args.baseline)):
+        parser.error("--output 與 --baseline 不能是同一個檔案")
+    return args
+
+
+def configure(args):
+    """在 import app 之前設定環境變數"""
+    os.environ.setdefault("LINE_CHANNEL_SECRET", "benchmark-secret")
+    os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark-token")
+    os.environ["SHEETS_BACKEND"] = "fake"
+    os.environ["FAKE_SHEETS_LATENCY"] = str(args.sheets_latency)
+    os.environ["FAKE_SHEETS_JITTER"] = "0"
+    os.environ["WEBHOOK_ASYNC"] = "0"
+    # 量測程式本身的延遲：預設不讓 sheets_quota 的每分鐘配額介入（可自行設定以模擬配額）
+    os.environ.setdefault("SHEETS_QUOTA_PER_MINUTE", "1000000")
+
+
+class StubMessagingApi:
+    """只記錄回覆的 MessagingApi"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.replies = 0
+
+    def reply_message(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        self.replies += 1
+
+
+class WebhookClient:
+    """產生並簽章 LINE webhook，送到 Flask test client"""
+
+    def __init__(self, app, secret):
+        self._client = app.test_client()
+        self._secret = secret.encode("utf-8")
+        self._sequence = 0
+
+    def event(self, kind, user_id, **fields):
+        self._sequence += 1
+        event = {
+            "type": kind,
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": f"01BENCH{self._sequence:020d}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": f"reply{self._sequence}",
+        }
+        if kind == "message":
+            event["message"] = {"type": "text", "id": str(self._sequence),
+                                "text": fields["text"], "quoteToken": "q"}
+        elif kind == "postback":
+            event["postback"] = {"data": fields["data"]}
+        elif kind == "follow":
+            event["follow"] = {"isUnblocked": False}
+        return event
+
+    def post(self, event):
+        body = json.dumps({"destination": "Ubench", "events": [event]})
+        signature = base64.b64encode(
+            hmac.new(self._secret, body.encode("utf-8"), hashlib.sha256).digest()
+        ).decode("ascii")
+        response = self._client.post(
+            "/callback", data=body,
+            headers={"X-Line-Signature": signature, "Content-Type": "application/json"},
+        )
+        return response.status_code
+
+
+def user_script(user_id, rng, compiled_questions):
+    """一位用戶的完整流程：[(事件類型, kind, 欄位), ...]"""
+    steps = [
+        ("follow", "follow", {}),
+        ("register", "message", {"text": f"用戶{user_id[-4:]}"}),
+        ("start_test", "message", {"text": "VIP 財富健康體檢表"}),
+    ]
+    for compiled in compiled_questions:
+        letters = "ABCD"[:len(compiled.scores)]
+        last = compiled.index == len(compiled_questions) - 1
+        if compiled.is_multiple:
+            # 題目卡片點一個，之後在選擇卡片上多選一個、取消一個再完成
+            first, second = rng.sample(letters, 2)
+            steps += [
+                ("toggle", "postback", {"data": first}),
+                ("toggle", "postback", {"data": f"toggle:{second}"}),
+                ("toggle", "postback", {"data": f"toggle:{second}"}),
+                ("complete_multiple", "postback", {"data": "complete_multiple"}),
+            ]
+        else:
+            steps.append(("result" if last else "answer", "message", {"text": rng.choice(letters)}))
+    return steps
+
+
+def percentile(sorted_values, fraction):
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies):
+    """延遲（秒）-> 統計（毫秒）"""
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "mean_ms": round(total / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        "throughput_per_s": round(len(values) / total, 1) if total else 0.0,
+    }
+
+
+def run(args):
+    configure(args)
+
+    import app as webhook_app
+    import crm_writer
+    from config import LINE_CHANNEL_SECRET
+    from questions import COMPILED_QUESTIONS
+
+    # 與 gunicorn worker 相同，計時前先載入 LINE SDK
+    webhook_app.warm_imports()
+    stub = StubMessagingApi(args.reply_latency)
+    webhook_app.get_messaging_api = lambda: stub
+    client = WebhookClient(webhook_app.app, LINE_CHANNEL_SECRET)
+    rng = random.Random(args.seed)
+
+    latencies = {event_type: [] for event_type in EVENT_TYPES}
+    errors = 0
+    started = time.perf_counter()
+    for i in range(args.users):
+        user_id = f"U{i:032x}"
+        for event_type, kind, fields in user_script(user_id, rng, COMPILED_QUESTIONS):
+            event = client.event(kind, user_id, **fields)
+            replies = stub.replies
+            before = time.perf_counter()
+            status = client.post(event)
+            latencies[event_type].append(time.perf_counter() - before)
+            if status != 200 or stub.replies != replies + 1:
+                errors += 1
+        if webhook_app.is_user_in_test(user_id):
+            # 最後一題之後應該已產生結果
+            errors += 1
+    elapsed = time.perf_counter() - started
+    crm_writer.drain()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "meta": {
+            "users": args.users,
+            "events": len(all_latencies),
+            "errors": errors,
+            "elapsed_s": round(elapsed, 3),
+            "sheets_latency_s": args.sheets_latency,
+            "reply_latency_s": args.reply_latency,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "overall": summarize(all_latencies),
+        "by_type": {event_type: summarize(values) for event_type, values in latencies.items()},
+    }
+
+
+def print_report(result, baseline=None):
+    meta = result["meta"]
+    print(f"{meta['users']} 位用戶，{meta['events']} 個事件，錯誤 {meta['errors']}，"
+          f"共 {meta['elapsed_s']} 秒")
+    print(f"{'event':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'events/s':>10}")
+    rows = [("overall", result["overall"])] + list(result["by_type"].items())
+    for name, stats in rows:
+        line = (f"{name:<20}{stats['count']:>7}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+                f"{stats['p99_ms']:>10.3f}{stats['throughput_per_s']:>10.1f}")
+        if baseline is not None:
+            base = baseline["overall"] if name == "overall" else baseline["by_type"].get(name)
+            if base and base["p50_ms"] and base["p95_ms"]:
+                line += (f"   p50 {(stats['p50_ms'] / base['p50_ms'] - 1) * 100:+6.1f}%"
+                         f"  p95 {(stats['p95_ms'] / base['p95_ms'] - 1) * 100:+6.1f}%")
+        print(line)
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    result = run(args)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"結果已寫入 {args.output}")
+    return 1 if result["meta"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""webhook 壓力測試工具（只使用標準函式庫，可在任何機器上執行）
+
+對執行中的服務的 /callback 以目標速率送出簽章正確的 LINE webhook，
+模擬大量用戶同時做測驗（加入好友 → 姓名 → 開始測試 → 8 題 → 結果），
+每位用戶在兩個事件之間有隨機的思考時間。
+
+延遲從「排定送出的時間」起算，服務來不及處理時排隊的時間也會算進去。
+--rates 指定多個速率時依序各跑 --step-seconds 秒，找出飽和點：
+實際吞吐量低於排定送出速率的 90%、錯誤率超過 --max-error-rate 或 p95 超過 --slo-ms。
+
+服務端請設定 LINE_API_HOST 指向 --line-stub-port 啟動的假 LINE API，
+避免用假的 reply token 呼叫真正的 LINE API：
+
+  LINE_API_HOST=http://127.0.0.1:9100 gunicorn app:app
+  python benchmarks/loadgen.py --url http://127.0.0.1:8000/callback --secret $LINE_CHANNEL_SECRET \\
+      --line-stub-port 9100 --users 2000 --think-time 3 --rates 50,100,200,400 --step-seconds 30
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import heapq
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUESTION_COUNT = 8
+MULTIPLE_INDEX = 4  # Q5 為多選題
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+_event_sequence = itertools.count()  # 整次執行共用，webhookEventId 不重複（服務端會去重）
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0], formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[1:]),
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000/callback")
+    parser.add_argument("--secret", default=os.environ.get("LINE_CHANNEL_SECRET", ""),
+                        help="LINE channel secret（預設讀取環境變數 LINE_CHANNEL_SECRET）")
+    parser.add_argument("--users", type=int, default=1000, help="同時在線的模擬用戶數")
+    parser.add_argument("--think-time", type=float, default=3.0, help="事件間平均思考秒數（指數分布）")
+    parser.add_argument("--rates", default="20", help="目標速率（事件/秒），逗號分隔為多段")
+    parser.add_argument("--step-seconds", type=float, default=30.0, help="每段速率的秒數")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時送出的請求上限")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="p95 延遲上限")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--line-stub-port", type=int, help="在此 port 啟動假 LINE API")
+    parser.add_argument("--line-stub-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="將各段結果寫入 JSON")
+    return parser.parse_args()
+
+
+# ===== 假 LINE API =====
+
+def start_line_stub(port, latency):
+    """回覆所有 reply 請求 200 的假 LINE API"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if latency:
+                time.sleep(latency)
+            body = b'{"sentMessages":[{"id":"1","quoteToken":"q"}]}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="line-stub", daemon=True).start()
+    return server
+
+
+# ===== 模擬用戶 =====
+
+def user_steps(rng):
+    """一位用戶的事件：[(kind, 欄位), ...]；選項只用 A～C（每題至少三個選項）"""
+    steps = [
+        ("follow", {}),
+        ("message", {"text": f"壓測{rng.randrange(10000)}"}),
+        ("message", {"text": "VIP 財富健康體檢表"}),
+    ]
+    for index in range(QUESTION_COUNT):
+        if index == MULTIPLE_INDEX:
+            first, second = rng.sample("ABC", 2)
+            steps += [
+                ("postback", {"data": first}),
+                ("postback", {"data": f"toggle:{second}"}),
+                ("postback", {"data": "complete_multiple"}),
+            ]
+        else:
+            steps.append(("message", {"text": rng.choice("ABC")}))
+    return steps
+
+
+class SimulatedUser:
+    __slots__ = ("user_id", "steps", "position")
+
+    def __init__(self, user_id, steps):
+        self.user_id = user_id
+        self.steps = steps
+        self.position = 0
+
+
+class Histogram:
+    """以固定的對數刻度統計延遲，並保留原始值計算百分位數"""
+
+    def __init__(self):
+        self.values = []
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, ms):
+        self.values.append(ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, fraction):
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        return values[min(len(values) - 1, max(0, int(fraction * len(values) + 0.5) - 1))]
+
+    def render(self, width=40):
+        peak = max(self.counts) or 1
+        lines = []
+        lower = 0
+        for bound, count in zip(BUCKETS_MS + (None,), self.counts):
+            label = f"{lower:>5}-{bound:<5} ms" if bound else f"{lower:>5}+      ms"
+            lines.append(f"  {label} {count:>7} {'#' * round(count / peak * width)}")
+            lower = bound
+        return "\n".join(lines)
+
+
+class LoadStep:
+    """以目標速率送出事件 --step-seconds 秒"""
+
+    def __init__(self, args, rate, run_id, user_counter):
+        self.args = args
+        self.rate = rate
+        self.run_id = run_id
+        self._user_counter = user_counter
+        self._rng = random.Random(f"{args.seed}:{rate}" if args.seed is not None else None)
+        self._ready = []  # (可送出下一個事件的時間, 序號, 用戶)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._secret = args.secret.encode("utf-8")
+        self._url = urllib.parse.urlsplit(args.url)
+        self.histogram = Histogram()
+        self.sent = 0
+        self.errors = 0
+        self.error_kinds = {}
+        self.idle_slots = 0
+        self.completed_users = 0
+
+    # ----- 用戶與思考時間 -----
+
+    def _think(self):
+        return self._rng.expovariate(1.0 / self.args.think_time) if self.args.think_time > 0 else 0.0
+
+    def _new_user(self):
+        number = next(self._user_counter)
+        user_id = f"U{self.run_id:08x}{number:024x}"
+        return SimulatedUser(user_id, user_steps(self._rng))
+
+    def _push(self, ready_at, user):
+        heapq.heappush(self._ready, (ready_at, next(self._sequence), user))
+
+    # ----- HTTP -----
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self._url.scheme == "https" else http.client.HTTPConnection
+            conn = cls(self._url.hostname, self._url.port, timeout=self.args.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _body(self, user, kind, fields):
+        sequence = next(_event_sequence)
+        event = {
+            "type": kind,
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": user.user_id},
+            "webhookEventId": f"01LOAD{self.run_id:08x}{sequence:012d}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": f"load{self.run_id:08x}{sequence}",
+        }
+        if kind == "message":
+            event["message"] = {"type": "text", "id": str(sequence), "text": fields["text"],
+                                "quoteToken": "q"}
+        elif kind == "postback":
+            event["postback"] = {"data": fields["data"]}
+        elif kind == "follow":
+            event["follow"] = {"isUnblocked": False}
+        return json.dumps({"destination": "Uload", "events": [event]}).encode("utf-8")
+
+    def _send(self, user, scheduled):
+        kind, fields = user.steps[user.position]
+        body = self._body(user, kind, fields)
+        signature = base64.b64encode(hmac.new(self._secret, body, hashlib.sha256).digest())
+        error = None
+        try:
+            conn = self._connection()
+            conn.request("POST", self._url.path or "/callback", body=body, headers={
+                "Content-Type": "application/json",
+                "X-Line-Signature": signature.decode("ascii"),
+            })
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                error = f"HTTP {response.status}"
+        except Exception as e:
+            error = type(e).__name__
+            self._local.conn = None
+        finished = time.monotonic()
+
+        with self._lock:
+            self.sent += 1
+            self.histogram.record((finished - scheduled) * 1000)
+            if error:
+                self.errors += 1
+                self.error_kinds[error] = self.error_kinds.get(error, 0) + 1
+
+            user.position += 1
+            if user.position >= len(user.steps):
+                self.completed_users += 1
+                user = self._new_user()
+            self._push(finished + self._think(), user)
+
+    # ----- 執行 -----
+
+    def run(self, users):
+        """users：上一段留下的模擬用戶（第一段為 None，依思考時間錯開起始）"""
+        started = time.monotonic()
+        if users is None:
+            users = [(started + self._rng.uniform(0, self.args.think_time), self._new_user())
+                     for _ in range(self.args.users)]
+        for ready_at, user in users:
+            self._push(max(ready_at, started), user)
+
+        executor = ThreadPoolExecutor(self.args.concurrency, thread_name_prefix="loadgen")
+        deadline = started + self.args.step_seconds
+        for slot in itertools.count():
+            scheduled = started + slot / self.rate
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                if not self._ready or self._ready[0][0] > scheduled:
+                    # 所有用戶都在思考中，這個時段沒有事件可送
+                    self.idle_slots += 1
+                    continue
+                _, _, user = heapq.heappop(self._ready)
+            executor.submit(self._send, user, scheduled)
+        executor.shutdown(wait=True)
+        elapsed = time.monotonic() - started
+
+        slots = int(self.args.step_seconds * self.rate)
+        return {
+            "target_rate": self.rate,
+            "dispatched_rate": round((slots - self.idle_slots) / self.args.step_seconds, 1),
+            "achieved_rate": round(self.sent / elapsed, 1),
+            "sent": self.sent,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.sent, 4) if self.sent else 0.0,
+            "error_kinds": self.error_kinds,
+            "idle_slot_ratio": round(self.idle_slots / slots, 3) if slots else 0.0,
+            "completed_users": self.completed_users,
+            "p50_ms": round(self.histogram.percentile(0.50), 1),
+            "p95_ms": round(self.histogram.percentile(0.95), 1),
+            "p99_ms": round(self.histogram.percentile(0.99), 1),
+            "max_ms": round(max(self.histogram.values, default=0.0), 1),
+        }
+
+    def remaining_users(self):
+        return [(ready_at, user) for ready_at, _, user in self._ready]
+
+
+def is_saturated(result, args):
+    """用戶不足而沒送出的時段不算服務飽和，吞吐量以實際排定送出的速率為準"""
+    return (result["achieved_rate"] < result["dispatched_rate"] * 0.9
+            or result["error_rate"] > args.max_error_rate
+            or result["p95_ms"] > args.slo_ms)
+
+
+def main():
+    args = parse_args()
+    if not args.secret:
+        sys.exit("請以 --secret 或環境變數 LINE_CHANNEL_SECRET 提供 channel secret")
+    rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+
+    if args.line_stub_port:
+        start_line_stub(args.line_stub_port, args.line_stub_latency)
+        print(f"假 LINE API：http://127.0.0.1:{args.line_stub_port}（服務端請設定 LINE_API_HOST）")
+
+    if args.think_time > 0 and args.users / args.think_time < max(rates) * 0.9:
+        print(f"注意：{args.users} 位用戶、平均思考 {args.think_time} 秒，"
+              f"最多約 {args.users / args.think_time:.0f} 事件/秒，無法達到最高目標速率")
+
+    run_id = random.Random(args.seed).getrandbits(32) if args.seed is not None \
+        else int.from_bytes(os.urandom(4), "big")
+    user_counter = itertools.count()
+    results = []
+    users = None
+    saturation = None
+    for rate in rates:
+        step = LoadStep(args, rate, run_id, user_counter)
+        result = step.run(users)
+        users = step.remaining_users()
+        results.append(result)
+
+        print(f"\n目標 {rate:g}/s → 實際 {result['achieved_rate']}/s，"
+              f"錯誤 {result['errors']}/{result['sent']}（{result['error_rate']:.2%}），"
+              f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms，"
+              f"完成測驗 {result['completed_users']} 人")
+        if result["error_kinds"]:
+            print(f"  錯誤類型：{result['error_kinds']}")
+        if result["idle_slot_ratio"] > 0.05:
+            print(f"  注意：{result['idle_slot_ratio']:.0%} 的時段沒有可送的事件（增加 --users 或降低 --think-time）")
+        print(step.histogram.render())
+
+        if is_saturated(result, args):
+            saturation = rate
+            break
+
+    print()
+    sustained = [r["target_rate"] for r in results if not is_saturated(r, args)]
+    if saturation is None:
+        print(f"未達飽和：最高 {rates[-1]:g} 事件/秒 仍在 SLO 內（p95 ≤ {args.slo_ms:g} ms）")
+    else:
+        best = f"{max(sustained):g}" if sustained else "無"
+        print(f"飽和點：{saturation:g} 事件/秒（可穩定處理的最高速率：{best} 事件/秒）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "steps": results, "saturation_rate": saturation},
+                      f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""測試進度並行寫入驗證：同一用戶同時大量回答，確認沒有遺失的更新
+
+兩種情境（每個用戶各跑一次）：
+  advance：多個執行緒同時回答單選題，每次回答都必須推進一題
+  toggle ：多個執行緒同時點選多選題選項，最後的選擇必須等於各選項點擊次數的奇偶
+
+用法：
+  python benchmarks/session_concurrency.py                       # memory，執行緒並行
+  python benchmarks/session_concurrency.py --backend sqlite --processes 4
+  python benchmarks/session_concurrency.py --unsafe              # 不加鎖的舊寫法
+
+memory 儲存直接修改同一個物件，--unsafe 在 GIL 下很少重現遺失；
+sqlite 每次讀取都是新的副本，--unsafe 時幾乎每輪都會出現遺失的更新。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8, help="每個 process 的執行緒數")
+    parser.add_argument("--processes", type=int, default=1, help="只有 sqlite 可大於 1")
+    parser.add_argument("--toggles", type=int, default=25, help="每個執行緒點選的次數")
+    parser.add_argument("--unsafe", action="store_true", help="改用不加鎖的讀取-修改-寫回")
+    return parser.parse_args()
+
+
+def unsafe_process_answer(user_id, answer):
+    """舊版 process_answer 的寫法：讀取、修改、寫回之間沒有任何保護"""
+    import stress_test
+
+    session = stress_test._store.get(user_id)
+    if not session:
+        return None, None
+    status, data, action = stress_test._apply_answer(session, answer)
+    if action == "set":
+        stress_test._store.set(user_id, session)
+    elif action == "delete":
+        stress_test._store.delete(user_id)
+    return status, data
+
+
+def run_threads(target, count):
+    """同時啟動 count 個執行緒執行 target(i)"""
+    barrier = threading.Barrier(count)
+
+    def worker(i):
+        barrier.wait()
+        target(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def hammer(args, phase, user_ids, first_worker, threads):
+    """在目前 process 內以 threads 個執行緒對每個用戶送出回答"""
+    import stress_test
+    from questions import OPTION_LETTERS
+
+    answer = unsafe_process_answer if args.unsafe else stress_test.process_answer
+
+    def advance(i):
+        # 每個執行緒對每個用戶回答一次單選題
+        for user_id in user_ids:
+            answer(user_id, "A")
+
+    def toggle(i):
+        # 第 n 個回答者固定點選第 n % 選項數 個選項
+        letter = OPTION_LETTERS[(first_worker + i) % args.multiple_options]
+        for _ in range(args.toggles):
+            for user_id in user_ids:
+                answer(user_id, letter)
+
+    run_threads(advance if phase == "advance" else toggle, threads)
+
+
+def _child(args, phase, user_ids, first_worker, threads):
+    # 盡量頻繁切換執行緒，讓競爭更容易發生
+    sys.setswitchinterval(1e-6)
+    hammer(args, phase, user_ids, first_worker, threads)
+
+
+def run_phase(args, phase, user_ids, workers):
+    """把 workers 個回答者平均分到 args.processes 個 process 同時執行"""
+    counts = [workers // args.processes + (i < workers % args.processes)
+              for i in range(args.processes)]
+    firsts = [sum(counts[:i]) for i in range(args.processes)]
+    if args.processes == 1:
+        _child(args, phase, user_ids, 0, workers)
+        return
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_child, args=(args, phase, user_ids, first, count))
+        for first, count in zip(firsts, counts) if count
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def main():
+    args = parse_args()
+    if args.processes > 1 and args.backend != "sqlite":
+        sys.exit("memory 儲存無法跨 process 共用，--processes > 1 時請使用 --backend sqlite")
+
+    if args.backend == "sqlite":
+        os.environ["SESSION_DB_PATH"] = os.path.join(
+            tempfile.mkdtemp(prefix="session-concurrency-"), "sessions.db"
+        )
+    os.environ["SESSION_BACKEND"] = args.backend
+
+    import stress_test
+    from questions import COMPILED_QUESTIONS
+
+    multiple_index = next(c.index for c in COMPILED_QUESTIONS if c.is_multiple)
+    args.multiple_options = len(COMPILED_QUESTIONS[multiple_index].scores)
+    user_ids = [f"U{i:031d}" for i in range(args.users)]
+    started = time.perf_counter()
+
+    # advance：回答者數剛好等於多選題前的單選題數，全部生效時正好停在多選題
+    for user_id in user_ids:
+        stress_test.start_test(user_id)
+    run_phase(args, "advance", user_ids, multiple_index)
+    lost_advances = sum(
+        multiple_index - (stress_test.get_current_question_index(user_id) or 0)
+        for user_id in user_ids
+    )
+
+    # toggle：在多選題上同時點選，預期結果為各選項點擊次數的奇偶
+    workers = args.processes * args.threads
+    run_phase(args, "toggle", user_ids, workers)
+
+    clicks = [0] * args.multiple_options
+    for worker in range(workers):
+        clicks[worker % args.multiple_options] += args.toggles
+    expected_mask = sum(1 << option for option, count in enumerate(clicks) if count % 2)
+    wrong_masks = sum(
+        1 for user_id in user_ids if stress_test.get_multiple_mask(user_id) != expected_mask
+    )
+    elapsed = time.perf_counter() - started
+
+    mode = "unsafe" if args.unsafe else "locked"
+    print(f"backend={args.backend} processes={args.processes} threads={args.threads} "
+          f"users={args.users} mode={mode} ({elapsed:.2f}s)")
+    print(f"advance: 遺失 {lost_advances} / {args.users * multiple_index} 次推進")
+    print(f"toggle : {wrong_masks} / {args.users} 個用戶的選擇不正確 "
+          f"（每用戶 {workers * args.toggles} 次點選）")
+
+    if lost_advances or wrong_masks:
+        print("FAIL：有遺失的更新")
+        return 1
+    print("OK：沒有遺失的更新")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,110 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET', '')
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '')
+
+# Google Sheets 背景寫入（write-behind）：只用於測試結果，註冊狀態一律在回覆前同步寫入
+CRM_WRITE_BEHIND = os.environ.get('CRM_WRITE_BEHIND', '1') == '1'
+CRM_WRITE_QUEUE_SIZE = int(os.environ.get('CRM_WRITE_QUEUE_SIZE', '10000'))
+CRM_FLUSH_INTERVAL = float(os.environ.get('CRM_FLUSH_INTERVAL', '1.0'))
+CRM_WRITE_MAX_RETRIES = int(os.environ.get('CRM_WRITE_MAX_RETRIES', '5'))
+
+# Google Sheets 後端：google（真實的試算表）或 fake（記憶體內的假工作表，供離線基準測試）
+SHEETS_BACKEND = os.environ.get('SHEETS_BACKEND', 'google')
+# 假工作表每次請求的延遲與抖動（秒）、5xx 錯誤比例、每分鐘配額（0 為不限，超過回 429）、預先放入的用戶數
+FAKE_SHEETS_LATENCY = float(os.environ.get('FAKE_SHEETS_LATENCY', '0.2'))
+FAKE_SHEETS_JITTER = float(os.environ.get('FAKE_SHEETS_JITTER', '0.05'))
+FAKE_SHEETS_ERROR_RATE = float(os.environ.get('FAKE_SHEETS_ERROR_RATE', '0'))
+FAKE_SHEETS_QUOTA_PER_MINUTE = int(os.environ.get('FAKE_SHEETS_QUOTA_PER_MINUTE', '0'))
+FAKE_SHEETS_ROWS = int(os.environ.get('FAKE_SHEETS_ROWS', '0'))
+
+# CRM 主要儲存：sheets（直接讀寫 Google Sheets）或 sqlite（本地資料庫為準，背景鏡像到 Google Sheets）
+# sqlite 時 CRM_DB_PATH 請設在持久的磁碟上
+CRM_BACKEND = os.environ.get('CRM_BACKEND', 'sheets')
+CRM_DB_PATH = os.environ.get(
+    'CRM_DB_PATH', os.path.join(tempfile.gettempdir(), 'wealth_navigator_crm.db')
+)
+CRM_MIRROR_INTERVAL = float(os.environ.get('CRM_MIRROR_INTERVAL', '5'))
+CRM_MIRROR_BATCH = int(os.environ.get('CRM_MIRROR_BATCH', '200'))
+
+# Google Sheets 用戶索引：分段讀取的列數、讀取新增列的間隔、完整重新載入的間隔（秒，0 為停用）
+CRM_INDEX_LOAD_CHUNK = int(os.environ.get('CRM_INDEX_LOAD_CHUNK', '5000'))
+CRM_INDEX_REFRESH_INTERVAL = float(os.environ.get('CRM_INDEX_REFRESH_INTERVAL', '60'))
+CRM_INDEX_RECONCILE_INTERVAL = float(os.environ.get('CRM_INDEX_RECONCILE_INTERVAL', '3600'))
+# 同一台主機的 worker 新增列時更新此檔案的修改時間，背景更新只在它變動後才讀取工作表；
+# 其他主機或手動新增的列由完整重新載入或 sheet.find 補上
+CRM_INDEX_MARKER_PATH = os.environ.get(
+    'CRM_INDEX_MARKER_PATH', os.path.join(tempfile.gettempdir(), 'wealth_navigator_sheet_appends')
+)
+
+# 測試進度儲存：memory（單一 worker）或 sqlite（多個 worker 共用）
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_DB_PATH = os.environ.get(
+    'SESSION_DB_PATH', os.path.join(tempfile.gettempdir(), 'wealth_navigator_sessions.db')
+)
+# 測試進度閒置超過 SESSION_TTL_SECONDS 秒即失效；超過 SESSION_MAX_ENTRIES 筆時淘汰最久未使用的
+SESSION_TTL_SECONDS = float(os.environ.get('SESSION_TTL_SECONDS', '86400'))
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', '100000'))
+
+# LINE Messaging API 連線池：同時連線數上限與 TCP keep-alive 閒置秒數
+LINE_API_POOL_SIZE = int(os.environ.get('LINE_API_POOL_SIZE', '10'))
+LINE_API_KEEPALIVE_IDLE = int(os.environ.get('LINE_API_KEEPALIVE_IDLE', '60'))
+# 壓力測試時可改指向本機的假 LINE API（例如 benchmarks/loadgen.py --line-stub-port）
+LINE_API_HOST = os.environ.get('LINE_API_HOST', '')
+
+# webhook 背景處理：驗證簽章後立即回 200，事件交給背景執行緒（同一用戶依序處理）
+WEBHOOK_ASYNC = os.environ.get('WEBHOOK_ASYNC', '0') == '1'
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+# 佇列滿載超過 WEBHOOK_QUEUE_TIMEOUT 秒時回 503，由 LINE 重送
+WEBHOOK_QUEUE_TIMEOUT = float(os.environ.get('WEBHOOK_QUEUE_TIMEOUT', '1.0'))
+
+# webhook 重送去重：記住 WEBHOOK_DEDUPE_TTL_SECONDS 秒內處理過的 webhookEventId
+# 預設與測試進度使用相同的儲存（sqlite 時多個 worker 共用）
+WEBHOOK_DEDUPE_BACKEND = os.environ.get('WEBHOOK_DEDUPE_BACKEND', SESSION_BACKEND)
+WEBHOOK_DEDUPE_TTL_SECONDS = float(os.environ.get('WEBHOOK_DEDUPE_TTL_SECONDS', '3600'))
+WEBHOOK_DEDUPE_MAX_ENTRIES = int(os.environ.get('WEBHOOK_DEDUPE_MAX_ENTRIES', '100000'))
+
+# Google Sheets 配額：整個服務每分鐘可用的請求數（gunicorn 下自動依 worker 數分攤）
+SHEETS_QUOTA_PER_MINUTE = float(os.environ.get('SHEETS_QUOTA_PER_MINUTE', '60'))
+# 可以一次用掉的比例；其餘平均補充，任何 60 秒內的請求數都不超過配額
+SHEETS_QUOTA_BURST = float(os.environ.get('SHEETS_QUOTA_BURST', '0.25'))
+# 可一次用掉的額度中保留給互動請求的比例，背景寫入不能使用
+SHEETS_INTERACTIVE_RESERVE = float(os.environ.get('SHEETS_INTERACTIVE_RESERVE', '0.2'))
+# 互動請求等待額度與退避重試的上限秒數
+SHEETS_INTERACTIVE_TIMEOUT = float(os.environ.get('SHEETS_INTERACTIVE_TIMEOUT', '10'))
+# 429 / 5xx 重試次數與指數退避（秒）
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', '5'))
+SHEETS_BACKOFF_BASE = float(os.environ.get('SHEETS_BACKOFF_BASE', '0.5'))
+SHEETS_BACKOFF_MAX = float(os.environ.get('SHEETS_BACKOFF_MAX', '32'))
+
+# 請求追蹤：每個 LINE 事件一個 trace（Zipkin v2 JSON，每行一個 trace），寫入輪替的本地檔案
+# 多個 worker 時請在 TRACING_FILE 中加入 {pid}，每個 worker 各寫一個檔案
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '0') == '1'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', '1.0'))
+TRACING_FILE = os.environ.get(
+    'TRACING_FILE', os.path.join(tempfile.gettempdir(), 'wealth_navigator_traces.jsonl')
+)
+TRACING_FILE_MAX_BYTES = int(os.environ.get('TRACING_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACING_FILE_BACKUPS = int(os.environ.get('TRACING_FILE_BACKUPS', '5'))
+TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'wealth-navigator')
+# user_id 以 SHA-256(TRACING_USER_SALT + user_id) 的前 16 碼記錄，追蹤檔中不含原始 user_id
+TRACING_USER_SALT = os.environ.get('TRACING_USER_SALT', '')
+
+# 取樣 profiler：PROFILER_ENABLED=1 時 worker 啟動後持續以 PROFILER_WINDOW_SECONDS 秒為一段取樣，
+# 或設定 PROFILER_ADMIN_TOKEN 後以 POST /admin/profile 臨時開啟（未設定時此路由不存在）
+# 每 PROFILER_INTERVAL 秒取樣一次所有執行緒的堆疊，每段輸出一個 folded stacks 檔到 PROFILER_DIR
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+PROFILER_WINDOW_SECONDS = float(os.environ.get('PROFILER_WINDOW_SECONDS', '30'))
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', '0.01'))
+PROFILER_DIR = os.environ.get('PROFILER_DIR', tempfile.gettempdir())
+PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP', '10'))
+PROFILER_ADMIN_TOKEN = os.environ.get('PROFILER_ADMIN_TOKEN', '')
+
+# gunicorn preload：GUNICORN_PRELOAD=1 時 master 在 fork 前載入 app、建立所有 Flex 卡片範本與用戶索引，
+# 多個 worker 以 copy-on-write 共用這些記憶體分頁；程式更新時需重啟 master（HUP 不會重新載入）
+GUNICORN_PRELOAD = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
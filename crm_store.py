@@ -0,0 +1,387 @@
+"""本地 CRM 主要儲存（CRM_BACKEND=sqlite）
+
+註冊狀態與測試結果以 SQLite 為準，互動請求只查本地資料庫；
+背景的鏡像執行緒把有變更的列批次同步到 Google Sheets，
+工作表成為最終一致的報表檢視。
+
+- 第一次使用時從工作表匯入既有用戶（每個資料庫只匯入一次）
+- 每次寫入版本號加一，並以位元記錄變更的欄位；鏡像只寫回變更的欄位，
+  不會覆蓋業務人員在工作表上修改的其他欄位
+- 多個 worker 共用同一個資料庫，以租約確保同一時間只有一個 process 在鏡像
+- 鏡像依本地記錄的工作表列號寫入，寫入前以 A 欄確認；列被移動時以 find 重新定位，
+  不使用 google_sheets 的用戶索引
+- 匯入之後在工作表上的修改不會回到本地資料庫
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import sheets_quota
+from config import CRM_DB_PATH, CRM_MIRROR_INTERVAL, CRM_MIRROR_BATCH
+
+# on_sheet 欄位：尚未新增到工作表、已在工作表上、新增的結果不明（5xx 等，重送前先以 find 確認）
+NOT_ON_SHEET = 0
+ON_SHEET = 1
+APPEND_UNCERTAIN = 2
+
+
+class SQLiteCRMStore:
+    """以 SQLite（WAL 模式）儲存的用戶資料，欄位與工作表相同"""
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = tuple(fields)
+        self._columns = ", ".join(self.fields)
+        self._local = threading.local()
+
+    def _connection(self):
+        """每個執行緒各自一條連線；fork 後的新 process 會重新連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # 欄位不指定型別，分數等數值原樣保存
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS crm_users ("
+                " user_id TEXT PRIMARY KEY, "
+                + ", ".join(f"{field} DEFAULT ''" for field in self.fields[1:]) + ","
+                " version INTEGER NOT NULL DEFAULT 0,"
+                " mirrored_version INTEGER NOT NULL DEFAULT 0,"
+                " dirty INTEGER NOT NULL DEFAULT 0,"
+                " on_sheet INTEGER NOT NULL DEFAULT 0,"
+                " sheet_row INTEGER)"
+            )
+            _add_column(conn, "crm_users", "sheet_row INTEGER")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS crm_users_unmirrored"
+                " ON crm_users (user_id) WHERE version > mirrored_version"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS crm_meta (key TEXT PRIMARY KEY, value, expires REAL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, user_id):
+        """取得用戶的列資料（欄位順序與工作表相同），找不到回傳 None"""
+        return self._connection().execute(
+            f"SELECT {self._columns} FROM crm_users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def insert(self, user_id, row):
+        """新增用戶（已存在時保留原本的資料），待鏡像到工作表"""
+        values = [user_id] + list(row[1:len(self.fields)])
+        values.extend([""] * (len(self.fields) - len(values)))
+        self._connection().execute(
+            f"INSERT OR IGNORE INTO crm_users ({self._columns}, version, dirty)"
+            f" VALUES ({', '.join('?' * len(self.fields))}, 1, ?)",
+            values + [(1 << len(self.fields)) - 1],
+        )
+        return True
+
+    def update(self, user_id, fields):
+        """更新欄位並記錄變更的欄位，用戶不存在回傳 False"""
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        mask = 0
+        for field in fields:
+            mask |= 1 << self.fields.index(field)
+        cursor = self._connection().execute(
+            f"UPDATE crm_users SET {assignments}, version = version + 1, dirty = dirty | ?"
+            " WHERE user_id = ?",
+            list(fields.values()) + [mask, user_id],
+        )
+        return cursor.rowcount == 1
+
+    def import_rows(self, rows):
+        """匯入工作表上已有的列（已在工作表上，不需鏡像），整批在同一個交易內
+
+        rows: [(列號, 列資料), ...]
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO crm_users ({self._columns}, on_sheet, sheet_row)"
+                f" VALUES ({', '.join('?' * len(self.fields))}, 1, ?)",
+                (list(row) + [row_number] for row_number, row in rows),
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def changed(self, limit):
+        """尚未鏡像的用戶：[(user_id, 列資料, 變更欄位位元, 版本, on_sheet, 工作表列號), ...]"""
+        cursor = self._connection().execute(
+            f"SELECT {self._columns}, dirty, version, on_sheet, sheet_row FROM crm_users"
+            " WHERE version > mirrored_version LIMIT ?",
+            (limit,),
+        )
+        width = len(self.fields)
+        return [(row[0], list(row[:width])) + tuple(row[width:]) for row in cursor]
+
+    def mark_mirrored(self, user_id, version, on_sheet=True):
+        """鏡像成功；期間又有新的寫入時保留變更記錄，下一輪再送"""
+        self._connection().execute(
+            "UPDATE crm_users SET on_sheet = ?,"
+            " dirty = CASE WHEN version = ? THEN 0 ELSE dirty END,"
+            " mirrored_version = CASE WHEN version = ? THEN version ELSE mirrored_version END"
+            " WHERE user_id = ?",
+            (int(on_sheet), version, version, user_id),
+        )
+
+    def set_on_sheet(self, user_ids, on_sheet):
+        """只更新工作表狀態（不影響變更記錄）"""
+        self._connection().executemany(
+            "UPDATE crm_users SET on_sheet = ? WHERE user_id = ?",
+            [(on_sheet, user_id) for user_id in user_ids],
+        )
+
+    def set_sheet_rows(self, rows):
+        """記錄用戶在工作表上的列號（rows: user_id -> 列號，None 表示不明）"""
+        self._connection().executemany(
+            "UPDATE crm_users SET sheet_row = ? WHERE user_id = ?",
+            [(row_number, user_id) for user_id, row_number in rows.items()],
+        )
+
+    def mark_missing(self, user_id):
+        """工作表上找不到此用戶（例如被手動刪除），下一輪改為新增整列"""
+        self._connection().execute(
+            "UPDATE crm_users SET on_sheet = 0, sheet_row = NULL, dirty = ? WHERE user_id = ?",
+            ((1 << len(self.fields)) - 1, user_id),
+        )
+
+    def get_meta(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM crm_meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO crm_meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def acquire_lease(self, name, owner, ttl):
+        """取得或延長租約（其他 process 持有且未過期時回傳 False）"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO crm_meta (key, value, expires) VALUES (?, '', 0)", (name,)
+        )
+        cursor = conn.execute(
+            "UPDATE crm_meta SET value = ?, expires = ?"
+            " WHERE key = ? AND (value = ? OR expires < ?)",
+            (owner, now + ttl, name, owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def close(self):
+        """關閉目前執行緒的連線（fork 前呼叫，連線不會帶到子 process）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM crm_users").fetchone()[0]
+
+    def stats(self):
+        """用戶數與尚未鏡像到工作表的筆數"""
+        conn = self._connection()
+        unmirrored = conn.execute(
+            "SELECT COUNT(*) FROM crm_users WHERE version > mirrored_version"
+        ).fetchone()[0]
+        return {"size": len(self), "unmirrored": unmirrored}
+
+
+def _add_column(conn, table, column):
+    """舊版建立的資料表補上新欄位（多個 process 同時補上時忽略重複）"""
+    name = column.split()[0]
+    if any(info[1] == name for info in conn.execute(f"PRAGMA table_info({table})")):
+        return
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+    except sqlite3.OperationalError as e:
+        if "duplicate column" not in str(e):
+            raise
+
+
+_store = None
+_store_lock = threading.Lock()
+_imported = False
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_store(start_mirror=True):
+    """取得本地儲存；尚未從工作表匯入且匯入失敗時回傳 None
+
+    start_mirror=False 時不啟動鏡像執行緒（gunicorn preload 在 fork 前匯入）
+    """
+    global _store
+    if _store is None:
+        from google_sheets import FIELD_COLUMNS
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteCRMStore(CRM_DB_PATH, FIELD_COLUMNS)
+    if not _ensure_imported():
+        return None
+    if start_mirror:
+        _ensure_mirror()
+    return _store
+
+
+def _ensure_imported():
+    """資料庫第一次使用時從工作表匯入既有用戶"""
+    global _imported
+    if _imported:
+        return True
+    with _store_lock:
+        if _imported:
+            return True
+        if _store.get_meta("imported") is None:
+            from google_sheets import get_sheet, _new_table, _read_rows
+            sheet = get_sheet()
+            if sheet is None:
+                return False
+            try:
+                table = _new_table()
+                _read_rows(sheet, table)
+            except Exception as e:
+                print(f"匯入 Google Sheets 用戶錯誤: {e}")
+                return False
+            _store.import_rows((row_number, row) for _, row_number, row in table.items())
+            _store.set_meta("imported", time.time())
+        _imported = True
+        return True
+
+
+def _ensure_mirror():
+    """第一次使用時才啟動鏡像執行緒（避免在 gunicorn fork 前建立執行緒）"""
+    global _mirror
+    if _mirror is not None and _mirror.is_alive():
+        return
+    with _mirror_lock:
+        if _mirror is None or not _mirror.is_alive():
+            _mirror = threading.Thread(target=_mirror_loop, name="crm-mirror", daemon=True)
+            _mirror.start()
+
+
+def mirror_once():
+    """將有變更的用戶批次同步到工作表，回傳同步的筆數（未取得租約時為 0）"""
+    from google_sheets import FIELD_COLUMNS, get_sheet, append_user_rows, _write_fields
+
+    lease_ttl = max(30.0, CRM_MIRROR_INTERVAL * 6)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not _store.acquire_lease("mirror_lease", owner, lease_ttl):
+        return 0
+
+    changed = _store.changed(CRM_MIRROR_BATCH)
+    if not changed:
+        return 0
+
+    fields = tuple(FIELD_COLUMNS)
+    appends = [item for item in changed if item[4] != ON_SHEET]
+    updates = [item for item in changed if item[4] == ON_SHEET]
+    mirrored = 0
+
+    with sheets_quota.background():
+        sheet = get_sheet()
+        if sheet is None:
+            return 0
+
+        # 上次新增的結果不明時，先確認列是否已寫入；已寫入的下一輪改為更新整列
+        uncertain = [item for item in appends if item[4] == APPEND_UNCERTAIN]
+        if uncertain:
+            found = {}
+            for item in uncertain:
+                cell = sheet.find(item[0])
+                if cell is not None:
+                    found[item[0]] = cell.row
+            _store.set_sheet_rows(found)
+            _store.set_on_sheet(found, ON_SHEET)
+            appends = [item for item in appends if item[0] not in found]
+
+        # 先新增列，再更新已在工作表上的列；只有確定沒有寫入時才直接重送
+        if appends:
+            result = append_user_rows([(item[0], item[1]) for item in appends])
+            if result:
+                _store.set_sheet_rows({item[0]: row_number for item, row_number in zip(appends, result)})
+                for item in appends:
+                    _store.mark_mirrored(item[0], item[3])
+                mirrored += len(appends)
+            elif result is None:
+                _store.set_on_sheet([item[0] for item in appends], APPEND_UNCERTAIN)
+
+        if updates:
+            changes = {
+                user_id: {
+                    field: row[column] for column, field in enumerate(fields)
+                    if dirty & (1 << column) and column > 0
+                }
+                for user_id, row, dirty, _, _, _ in updates
+            }
+            rows = _locate_rows(sheet, {
+                item[0]: item[5] for item in updates if changes[item[0]]
+            })
+
+            _write_fields(sheet, {
+                user_id: row_number for user_id, row_number in rows.items() if row_number is not None
+            }, changes)
+            for user_id, _, _, version, _, _ in updates:
+                if user_id in rows and rows[user_id] is None:
+                    _store.mark_missing(user_id)
+                else:
+                    _store.mark_mirrored(user_id, version)
+                    mirrored += 1
+    return mirrored
+
+
+def _locate_rows(sheet, rows):
+    """確認本地記錄的列號仍屬於該用戶（一次 batch_get），已移動或不明的以 find 重新定位
+
+    rows: user_id -> 列號（可為 None）；回傳相同格式，工作表上找不到的用戶為 None
+    """
+    from google_sheets import _moved_rows
+
+    known = {user_id: row_number for user_id, row_number in rows.items() if row_number}
+    stale = set(_moved_rows(sheet, known)) if known else set()
+    stale.update(user_id for user_id, row_number in rows.items() if not row_number)
+    if not stale:
+        return rows
+
+    located = {}
+    for user_id in stale:
+        cell = sheet.find(user_id)
+        located[user_id] = cell.row if cell is not None else None
+    _store.set_sheet_rows({user_id: row for user_id, row in located.items() if row is not None})
+    return {**rows, **located}
+
+
+def _mirror_loop():
+    """背景執行緒：每隔 CRM_MIRROR_INTERVAL 秒同步一次，積壓時連續同步"""
+    while True:
+        try:
+            if mirror_once() >= CRM_MIRROR_BATCH:
+                continue
+        except Exception as e:
+            print(f"CRM 鏡像錯誤: {e}")
+        time.sleep(CRM_MIRROR_INTERVAL)
+
+
+def close():
+    """關閉目前執行緒的資料庫連線"""
+    if _store is not None:
+        _store.close()
+
+
+def stats():
+    """本地儲存的用戶數與尚未鏡像的筆數"""
+    if _store is None:
+        return {"size": 0, "unmirrored": 0}
+    return _store.stats()
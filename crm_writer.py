@@ -0,0 +1,135 @@
+"""Google Sheets 背景寫入（write-behind）
+
+測試結果先進入有上限的佇列，由背景執行緒定期合併成一次 batch_update 送出；
+失敗的資料保留到下一輪重試，結束時由 drain() 全部送出。
+註冊狀態（新增列、姓名、完成註冊）會決定其他 worker 的回覆，一律在回覆前同步寫入，不經過這裡。
+"""
+import atexit
+import queue
+import threading
+import time
+
+import sheets_quota
+from config import CRM_WRITE_QUEUE_SIZE, CRM_FLUSH_INTERVAL, CRM_WRITE_MAX_RETRIES
+
+_queue = queue.Queue(maxsize=CRM_WRITE_QUEUE_SIZE)
+_stop = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+# 背景執行緒尚未送出的資料（只有背景執行緒與 drain 會存取）
+_pending_updates = {}   # user_id -> [欄位字典, 重試次數]
+_flush_lock = threading.Lock()
+
+
+def _ensure_worker():
+    """第一次寫入時才啟動背景執行緒（避免在 gunicorn fork 前建立執行緒）"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _stop.clear()
+            _worker = threading.Thread(target=_run, name="crm-writer", daemon=True)
+            _worker.start()
+
+
+def submit_update(user_id, fields):
+    """排入欄位更新；佇列已滿時直接同步寫入"""
+    try:
+        _queue.put_nowait((user_id, dict(fields)))
+    except queue.Full:
+        from google_sheets import batch_update_users
+        written = batch_update_users({user_id: fields})
+        return bool(written) and user_id in written
+    _ensure_worker()
+    return True
+
+
+def pending_count():
+    """尚未寫入 Google Sheets 的筆數"""
+    return _queue.qsize() + len(_pending_updates)
+
+
+def pending_user_ids():
+    """尚有資料未寫入 Google Sheets 的用戶"""
+    with _queue.mutex:
+        user_ids = {item[0] for item in _queue.queue}
+    with _flush_lock:
+        user_ids.update(_pending_updates)
+    return user_ids
+
+
+def _collect():
+    """把佇列內容併入待送出資料；同一用戶的更新合併，較新的值覆蓋舊值"""
+    while True:
+        try:
+            user_id, data = _queue.get_nowait()
+        except queue.Empty:
+            return
+
+        pending = _pending_updates.setdefault(user_id, [{}, 0])
+        pending[0].update(data)
+
+
+def flush():
+    """立即送出目前累積的寫入，回傳是否全部成功（配額讓給互動請求優先使用）"""
+    with _flush_lock, sheets_quota.background():
+        _collect()
+        _flush_updates()
+        return not _pending_updates
+
+
+def _flush_updates():
+    """將待更新的欄位以一次 batch_update 送出，未寫入的留待下一輪"""
+    from google_sheets import batch_update_users
+
+    if not _pending_updates:
+        return
+    written = batch_update_users({
+        user_id: pending[0] for user_id, pending in _pending_updates.items()
+    }) or set()
+
+    for user_id, pending in list(_pending_updates.items()):
+        if user_id in written:
+            del _pending_updates[user_id]
+            continue
+        pending[1] += 1
+        if pending[1] > CRM_WRITE_MAX_RETRIES:
+            print(f"CRM 更新重試失敗，放棄資料: {user_id} {pending[0]}")
+            del _pending_updates[user_id]
+
+
+def _run():
+    """背景執行緒：每隔 CRM_FLUSH_INTERVAL 秒送出一次"""
+    while not _stop.wait(CRM_FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception as e:
+            print(f"CRM 背景寫入錯誤: {e}")
+
+
+def drain(timeout=10.0):
+    """停止背景執行緒並送出所有尚未寫入的資料（worker 結束前呼叫）"""
+    _stop.set()
+    if _worker is not None:
+        _worker.join(timeout)
+
+    for attempt in range(CRM_WRITE_MAX_RETRIES + 1):
+        if pending_count() == 0:
+            return True
+        if attempt:
+            time.sleep(CRM_FLUSH_INTERVAL)
+        try:
+            if flush():
+                return True
+        except Exception as e:
+            print(f"CRM 寫入錯誤: {e}")
+
+    remaining = pending_count()
+    if remaining:
+        print(f"CRM 仍有 {remaining} 筆資料未寫入")
+    return remaining == 0
+
+
+atexit.register(drain)
@@ -0,0 +1,159 @@
+"""webhook 事件去重
+
+LINE 在我們回應太慢時會重送 webhook（deliveryContext.isRedelivery），
+同一事件的 webhookEventId 不變。記住最近處理過的 webhookEventId，
+重送的事件直接略過，不會重複推進測試或重複寫入 Google Sheets。
+
+memory：單一 process 內的 OrderedDict（預設）
+sqlite：多個 gunicorn worker 共用的 SQLite（與 session 同一個資料庫檔）
+
+兩者都只保留 ttl 秒內的事件，且最多 max_entries 筆；每次檢查為 O(1)。
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    WEBHOOK_DEDUPE_BACKEND,
+    WEBHOOK_DEDUPE_TTL_SECONDS,
+    WEBHOOK_DEDUPE_MAX_ENTRIES,
+    SESSION_DB_PATH,
+)
+from session_store import ensure_row_counter, row_count
+
+
+class MemoryEventDedupe:
+    """process 內的事件去重（只適用單一 worker）"""
+
+    def __init__(self, ttl=WEBHOOK_DEDUPE_TTL_SECONDS, max_entries=WEBHOOK_DEDUPE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # webhookEventId -> 收到時間，依收到時間由舊到新排列
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def first_seen(self, event_id):
+        """第一次收到此事件時記錄並回傳 True；ttl 內重複收到回傳 False"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if event_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[event_id] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
+
+    def forget(self, event_id):
+        """處理失敗時移除記錄，讓 LINE 重送的事件可以再處理一次"""
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def _evict(self, now):
+        """從最舊的一端移除超過 ttl 的記錄"""
+        while self._seen:
+            oldest = next(iter(self._seen.values()))
+            if now - oldest <= self.ttl:
+                break
+            self._seen.popitem(last=False)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def stats(self):
+        """目前記錄筆數與略過的重送事件數"""
+        return {"size": len(self), "duplicates": self.duplicates}
+
+
+class SQLiteEventDedupe:
+    """以 SQLite（WAL 模式）在多個 worker process 間共用事件去重"""
+
+    # 每記錄幾次清理一次過期事件
+    EVICT_EVERY = 100
+
+    def __init__(self, path, ttl=WEBHOOK_DEDUPE_TTL_SECONDS,
+                 max_entries=WEBHOOK_DEDUPE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        # 本 process 的統計
+        self.duplicates = 0
+
+    def _connection(self):
+        """每個執行緒各自一條連線；fork 後的新 process 會重新連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS webhook_events ("
+                " event_id TEXT PRIMARY KEY,"
+                " seen_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS webhook_events_seen_at ON webhook_events (seen_at)"
+            )
+            ensure_row_counter(conn, "webhook_events")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def first_seen(self, event_id):
+        """第一次收到此事件時記錄並回傳 True；ttl 內重複收到回傳 False"""
+        conn = self._connection()
+        now = time.time()
+        # 已過期的舊記錄視為新事件
+        conn.execute(
+            "DELETE FROM webhook_events WHERE event_id = ? AND seen_at < ?",
+            (event_id, now - self.ttl),
+        )
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO webhook_events (event_id, seen_at) VALUES (?, ?)",
+            (event_id, now),
+        )
+        if cursor.rowcount != 1:
+            self.duplicates += 1
+            return False
+
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self._evict(conn, now)
+        return True
+
+    def forget(self, event_id):
+        """處理失敗時移除記錄，讓 LINE 重送的事件可以再處理一次"""
+        self._connection().execute(
+            "DELETE FROM webhook_events WHERE event_id = ?", (event_id,)
+        )
+
+    def _evict(self, conn, now):
+        """刪除過期的記錄，以及超過筆數上限時最舊的（依 seen_at 索引，筆數由觸發器維護）"""
+        conn.execute("DELETE FROM webhook_events WHERE seen_at < ?", (now - self.ttl,))
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM webhook_events WHERE event_id IN ("
+                " SELECT event_id FROM webhook_events ORDER BY seen_at LIMIT ?)",
+                (overflow,),
+            )
+
+    def __len__(self):
+        return row_count(self._connection(), "webhook_events")
+
+    def stats(self):
+        """目前記錄筆數與本 process 略過的重送事件數"""
+        return {"size": len(self), "duplicates": self.duplicates}
+
+
+def create_event_dedupe():
+    """依 WEBHOOK_DEDUPE_BACKEND 建立事件去重"""
+    if WEBHOOK_DEDUPE_BACKEND == "sqlite":
+        return SQLiteEventDedupe(SESSION_DB_PATH)
+    return MemoryEventDedupe()
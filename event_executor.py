@@ -0,0 +1,106 @@
+"""webhook 事件背景處理
+
+事件依 key（user_id）固定分配到同一個執行緒：同一用戶的事件依序處理，
+不同用戶的事件平行處理。每個執行緒有自己的有上限佇列。
+"""
+import queue
+import threading
+import time
+import traceback
+
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_TIMEOUT
+
+_queues = []
+_threads = []
+_start_lock = threading.Lock()
+_stats_lock = threading.Lock()
+
+# 統計：已處理筆數、佇列等待時間（秒）、佇列滿而拒絕的筆數
+_stats = {"processed": 0, "lag_total": 0.0, "lag_max": 0.0, "rejected": 0}
+
+_STOP = object()
+
+
+def _ensure_started():
+    """第一次使用時才建立執行緒（避免在 gunicorn fork 前建立）；已停止的執行緒以原本的佇列重新啟動"""
+    if _threads and all(thread.is_alive() for thread in _threads):
+        return
+    with _start_lock:
+        if not _queues:
+            for _ in range(WEBHOOK_WORKERS):
+                _queues.append(queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+                _threads.append(None)
+        for i, work_queue in enumerate(_queues):
+            if _threads[i] is not None and _threads[i].is_alive():
+                continue
+            # 佇列中已排隊的事件已記錄為處理過，LINE 不會重送，必須保留
+            thread = threading.Thread(
+                target=_run, args=(work_queue,), name=f"webhook-{i}", daemon=True
+            )
+            _threads[i] = thread
+            thread.start()
+
+
+def submit(key, func, *args):
+    """將工作排入 key 對應的執行緒；佇列持續滿載時回傳 False
+
+    呼叫端不可改為直接處理（同一 key 較早的工作還在排隊，會打亂順序），應回 503 讓 LINE 重送
+    """
+    _ensure_started()
+    work_queue = _queues[hash(key) % len(_queues)]
+    try:
+        work_queue.put((time.monotonic(), func, args), timeout=WEBHOOK_QUEUE_TIMEOUT)
+    except queue.Full:
+        with _stats_lock:
+            _stats["rejected"] += 1
+        return False
+    return True
+
+
+def _run(work_queue):
+    """背景執行緒：依序處理佇列中的工作"""
+    while True:
+        item = work_queue.get()
+        if item is _STOP:
+            return
+
+        queued_at, func, args = item
+        lag = time.monotonic() - queued_at
+        with _stats_lock:
+            _stats["processed"] += 1
+            _stats["lag_total"] += lag
+            _stats["lag_max"] = max(_stats["lag_max"], lag)
+
+        try:
+            func(*args)
+        except Exception:
+            print(f"webhook 事件處理錯誤:\n{traceback.format_exc()}")
+
+
+def queue_depth():
+    """目前排隊中的事件數"""
+    return sum(work_queue.qsize() for work_queue in _queues)
+
+
+def stats():
+    """佇列深度與處理延遲統計（lag：從排入到開始處理的秒數）"""
+    with _stats_lock:
+        processed = _stats["processed"]
+        return {
+            "depth": queue_depth(),
+            "processed": processed,
+            "rejected": _stats["rejected"],
+            "lag_avg": _stats["lag_total"] / processed if processed else 0.0,
+            "lag_max": _stats["lag_max"],
+        }
+
+
+def shutdown(timeout=10.0):
+    """處理完已排隊的事件後停止執行緒（worker 結束前呼叫）"""
+    for work_queue in _queues:
+        work_queue.put(_STOP)
+    deadline = time.monotonic() + timeout
+    for thread in _threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    _threads.clear()
+    _queues.clear()
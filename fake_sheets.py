@@ -0,0 +1,212 @@
+"""記憶體內的假 Google Sheets 工作表（SHEETS_BACKEND=fake）
+
+實作 google_sheets.py 用到的 gspread Worksheet 方法，資料放在記憶體中的表格，
+每次呼叫可加上延遲、抖動、隨機錯誤與每分鐘配額（超過時回 429），
+讓 CRM 相關的效能改動可以離線做基準測試與壓力測試。
+"""
+import random
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+from config import (
+    FAKE_SHEETS_LATENCY,
+    FAKE_SHEETS_JITTER,
+    FAKE_SHEETS_ERROR_RATE,
+    FAKE_SHEETS_QUOTA_PER_MINUTE,
+    FAKE_SHEETS_ROWS,
+)
+
+HEADER = ["Line ID", "姓名", "註冊時間", "測試分數", "測試等級", "測試時間", "客戶狀態", "備註"]
+
+Cell = namedtuple("Cell", ("row", "col", "value"))
+
+_A1 = re.compile(r"([A-Z]+)(\d+)")
+
+
+def _a1_to_rowcol(label):
+    """'C12' -> (12, 3)"""
+    letters, digits = _A1.fullmatch(label).groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return int(digits), column
+
+
+def _range_bounds(cell_range):
+    """'Sheet1!A2:H10' -> (2, 1, 10, 8)；單一儲存格時起訖相同"""
+    cell_range = cell_range.split("!")[-1]
+    start, _, end = cell_range.partition(":")
+    first_row, first_col = _a1_to_rowcol(start)
+    last_row, last_col = _a1_to_rowcol(end) if end else (first_row, first_col)
+    return first_row, first_col, last_row, last_col
+
+
+def _column_letter(column):
+    letters = ""
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+class FakeAPIError(Exception):
+    """與 gspread APIError 相同提供 code 與 response.status_code"""
+
+    def __init__(self, code, message):
+        super().__init__(f"APIError: [{code}]: {message}")
+        self.code = code
+        self.response = type("FakeResponse", (), {"status_code": code})()
+
+
+class FakeWorksheet:
+    """記憶體內的工作表；行為與 Google Sheets API 相同：讀取時去掉列尾的空白"""
+
+    def __init__(self, rows=None, latency=FAKE_SHEETS_LATENCY, jitter=FAKE_SHEETS_JITTER,
+                 error_rate=FAKE_SHEETS_ERROR_RATE, quota_per_minute=FAKE_SHEETS_QUOTA_PER_MINUTE,
+                 seed=None):
+        self._rows = [list(row) for row in rows] if rows is not None else [list(HEADER)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()  # 最近一分鐘內的請求時間
+        self.calls = {}
+        self.errors = {"quota": 0, "server": 0}
+
+    @property
+    def row_count(self):
+        return max(len(self._rows), 1000)
+
+    def _request(self, name):
+        """模擬一次 API 請求：計數、配額、延遲與隨機錯誤"""
+        now = time.monotonic()
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.quota_per_minute:
+                while self._recent and now - self._recent[0] >= 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.quota_per_minute:
+                    self.errors["quota"] += 1
+                    raise FakeAPIError(429, "Quota exceeded for quota metric 'Requests'")
+                self._recent.append(now)
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self.error_rate and self._random.random() < self.error_rate
+
+        if delay:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.errors["server"] += 1
+            raise FakeAPIError(503, "The service is currently unavailable.")
+
+    @staticmethod
+    def _trim(row):
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        return row
+
+    def _set(self, row_number, column, value):
+        while len(self._rows) < row_number:
+            self._rows.append([])
+        row = self._rows[row_number - 1]
+        if len(row) < column:
+            row.extend([""] * (column - len(row)))
+        row[column - 1] = value
+
+    def get_all_values(self):
+        self._request("get_all_values")
+        with self._lock:
+            width = max((len(row) for row in self._rows), default=0)
+            return [list(row) + [""] * (width - len(row)) for row in self._rows]
+
+    def get(self, cell_range):
+        self._request("get")
+        first_row, first_col, last_row, last_col = _range_bounds(cell_range)
+        with self._lock:
+            values = [self._trim(row[first_col - 1:last_col])
+                      for row in self._rows[first_row - 1:last_row]]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        self._request("batch_get")
+        results = []
+        with self._lock:
+            for cell_range in ranges:
+                first_row, first_col, last_row, last_col = _range_bounds(cell_range)
+                values = [self._trim(row[first_col - 1:last_col])
+                          for row in self._rows[first_row - 1:last_row]]
+                while values and not values[-1]:
+                    values.pop()
+                results.append(values)
+        return results
+
+    def row_values(self, row_number):
+        self._request("row_values")
+        with self._lock:
+            if row_number > len(self._rows):
+                return []
+            return self._trim(self._rows[row_number - 1])
+
+    def find(self, query):
+        self._request("find")
+        with self._lock:
+            for row_number, row in enumerate(self._rows, start=1):
+                for column, value in enumerate(row, start=1):
+                    if value == query:
+                        return Cell(row_number, column, value)
+        return None
+
+    def update_cell(self, row_number, column, value):
+        self._request("update_cell")
+        with self._lock:
+            self._set(row_number, column, value)
+
+    def batch_update(self, data, **kwargs):
+        self._request("batch_update")
+        with self._lock:
+            for item in data:
+                first_row, first_col, _, _ = _range_bounds(item["range"])
+                for row_offset, values in enumerate(item["values"]):
+                    for col_offset, value in enumerate(values):
+                        self._set(first_row + row_offset, first_col + col_offset, value)
+
+    def append_row(self, row, **kwargs):
+        return self._append([row], "append_row")
+
+    def append_rows(self, rows, **kwargs):
+        return self._append(rows, "append_rows")
+
+    def _append(self, rows, name):
+        self._request(name)
+        with self._lock:
+            # 與 API 相同，接在最後一個有資料的列之後
+            while self._rows and not any(self._rows[-1]):
+                self._rows.pop()
+            start = len(self._rows) + 1
+            self._rows.extend(list(row) for row in rows)
+            end = len(self._rows)
+        width = max((len(row) for row in rows), default=1)
+        return {"updates": {"updatedRange": f"Sheet1!A{start}:{_column_letter(width)}{end}"}}
+
+
+def make_rows(count):
+    """產生標題列加上 count 位已註冊用戶（約三成已完成測試）"""
+    rows = [list(HEADER)]
+    for i in range(count):
+        row = [f"U{i:032x}", f"用戶{i}", "2026/01/01 09:00", "", "", "", "待追蹤"]
+        if i % 3 == 0:
+            row[3:6] = [str(5 + i % 38), "🟡 黃燈：需要調整", "2026/01/01 09:05"]
+        rows.append(row)
+    return rows
+
+
+def create_fake_worksheet():
+    """依 FAKE_SHEETS_* 設定建立假工作表（預先放入 FAKE_SHEETS_ROWS 位用戶）"""
+    return FakeWorksheet(make_rows(FAKE_SHEETS_ROWS))
@@ -1,9 +1,26 @@
 """Google Sheets CRM 整合"""
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime, timezone, timedelta
 import os
 import json
+import re
+import threading
+import time
+
+import crm_store
+import crm_writer
+import metrics
+import sheets_quota
+from config import (
+    CRM_BACKEND,
+    SHEETS_BACKEND,
+    CRM_WRITE_BEHIND,
+    CRM_INDEX_LOAD_CHUNK,
+    CRM_INDEX_REFRESH_INTERVAL,
+    CRM_INDEX_RECONCILE_INTERVAL,
+    CRM_INDEX_MARKER_PATH,
+)
+from sheets_quota import ThrottledWorksheet
+from user_table import UserTable
 
 # 台灣時區 (UTC+8)
 TW_TIMEZONE = timezone(timedelta(hours=8))
@@ -17,17 +34,54 @@ def get_tw_time():
 SPREADSHEET_ID = "1L9m-Vq1J9iN_daSJ-K1lLuObl5fkGW6ImWSUTSZUYMo"
 CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), "google_credentials.json")
 
+# 欄位對應（欄號從 1 開始）
+FIELD_COLUMNS = {
+    "user_id": 1,        # A: Line ID
+    "name": 2,           # B: 姓名
+    "register_time": 3,  # C: 註冊時間
+    "score": 4,          # D: 測試分數
+    "level": 5,          # E: 測試等級
+    "test_time": 6,      # F: 測試時間
+    "status": 7,         # G: 客戶狀態
+    "note": 8,           # H: 備註
+}
+# 以 USER_ENTERED 寫入的欄位：時間與分數存成日期與數字（與原本的 update_cell 相同）；
+# 其他欄位（用戶輸入的姓名等文字）以 RAW 寫入，不會被當成公式
+USER_ENTERED_FIELDS = frozenset(("register_time", "score", "test_time"))
+ROW_WIDTH = len(FIELD_COLUMNS)
+FIRST_DATA_ROW = 2  # 第 1 列為標題
+LAST_COLUMN = chr(ord("A") + ROW_WIDTH - 1)
+
 # 初始化 Google Sheets 客戶端
 _client = None
 _sheet = None
 
+# 用戶索引（欄式）：user_id -> 列號與該列資料
+# 背景執行緒以背景配額分段讀取整張表（載入完成前查詢退回 sheet.find），之後每次寫入
+# 同步更新（write-through），並在同一台主機有新增列時只讀取新增的列、每隔一段時間完整重新載入
+_user_table = None
+_loaded_rows = 0       # 已讀取到的最後一個有資料的列號
+_dirty_users = None    # 完整重新載入期間有本地寫入的用戶
+_index_lock = threading.RLock()
+_refresher = None
+_refresher_lock = threading.Lock()
+_LOAD_RETRY_SECONDS = 10  # 背景載入失敗後重試的間隔
+
 
 def get_sheet():
-    """取得 Google Sheet 工作表"""
+    """取得 Google Sheet 工作表（所有操作都經過配額控管）"""
     global _client, _sheet
 
+    if _sheet is None and SHEETS_BACKEND == "fake":
+        from fake_sheets import create_fake_worksheet
+        _sheet = create_fake_worksheet()
+
     if _sheet is None:
         try:
+            # gspread 與 google-auth（含 requests）在第一次連線時才載入
+            import gspread
+            from google.oauth2.service_account import Credentials
+
             scopes = [
                 "https://www.googleapis.com/auth/spreadsheets",
                 "https://www.googleapis.com/auth/drive"
@@ -51,15 +105,421 @@ def get_sheet():
             print(f"Google Sheets 連線錯誤: {e}")
             return None
 
-    return _sheet
+    return ThrottledWorksheet(_sheet)
 
 
-def add_user_registration(user_id, name):
-    """新增用戶註冊資料"""
+# ===== 用戶索引 =====
+
+def _pad_row(row):
+    """補齊列資料到固定欄數"""
+    row = list(row[:ROW_WIDTH])
+    row.extend([""] * (ROW_WIDTH - len(row)))
+    return row
+
+
+def _is_row_complete(row):
+    """已有姓名或註冊時間的列不會再退回註冊中，可直接信任快取"""
+    return bool(row[FIELD_COLUMNS["name"] - 1] or row[FIELD_COLUMNS["register_time"] - 1])
+
+
+def _new_table():
+    # 分數、等級、狀態的值只有少數幾種，共用字串物件
+    return UserTable(ROW_WIDTH, shared_columns=(
+        FIELD_COLUMNS["score"] - 1,
+        FIELD_COLUMNS["level"] - 1,
+        FIELD_COLUMNS["status"] - 1,
+    ))
+
+
+def _read_rows(sheet, table, start_row=FIRST_DATA_ROW):
+    """從 start_row 起分段讀取到表尾並加入 table，回傳最後一個有資料的列號
+
+    每段 CRM_INDEX_LOAD_CHUNK 列，讀完一段就轉進欄式表，
+    不會同時持有整張表的原始資料。API 會省略每段結尾的空白列，
+    較短的一段不代表表尾；整段空白或超出工作表範圍才停止。
+    """
+    last_row = start_row - 1
+    chunk_start = start_row
+    while True:
+        chunk_end = chunk_start + CRM_INDEX_LOAD_CHUNK - 1
+        try:
+            rows = sheet.get(f"A{chunk_start}:{LAST_COLUMN}{chunk_end}")
+        except Exception as e:
+            # 起始列已超出工作表範圍時 API 回 400，視為表尾
+            if sheets_quota.status_code(e) != 400:
+                raise
+            return last_row
+        if not rows:
+            return last_row
+        for offset, row in enumerate(rows, start=chunk_start):
+            if row and row[0]:
+                table.add(row[0], offset, row)
+        last_row = chunk_start + len(rows) - 1
+        chunk_start = chunk_end + 1
+
+
+def _load_user_index(sheet, start_refresher=True):
+    """分段讀取整張表建立索引（呼叫端需持有 _index_lock）"""
+    global _user_table, _loaded_rows
+
+    table = _new_table()
+    _loaded_rows = _read_rows(sheet, table)
+    _user_table = table
+    if start_refresher:
+        _ensure_refresher()
+
+
+def warm_user_index(start_threads=True):
+    """啟動時預先載入用戶索引，回傳目前索引中的用戶數
+
+    worker 內只啟動背景執行緒，以背景配額載入，不佔用互動請求的額度也不拖慢 worker 啟動；
+    start_threads=False 時直接在呼叫端載入（gunicorn preload 在 fork 前載入，
+    索引由所有 worker 共用；worker 啟動後再呼叫一次即可啟動背景更新）
+    """
+    if CRM_BACKEND == "sqlite":
+        # 本地資料庫為準：只需確認已從工作表匯入
+        store = crm_store.get_store(start_mirror=start_threads)
+        return len(store) if store is not None else 0
+
+    sheet = get_sheet()
+    if sheet is None:
+        return 0
+
+    if start_threads:
+        _ensure_refresher()
+        with _index_lock:
+            return len(_user_table) if _user_table is not None else 0
+
+    try:
+        # fork 前只有 master 使用配額，等待配額不設期限
+        with sheets_quota.background(), _index_lock:
+            if _user_table is None:
+                _load_user_index(sheet, start_refresher=False)
+            return len(_user_table)
+    except Exception as e:
+        print(f"載入用戶索引錯誤: {e}")
+        return 0
+
+
+def release_connections():
+    """關閉 Google Sheets 與本地資料庫的連線（gunicorn fork 前呼叫，連線不會由多個 worker 共用）"""
+    if _client is not None:
+        _client.http_client.session.close()
+    crm_store.close()
+
+
+def reset_user_index():
+    """清除用戶索引並在背景重新載入（例如手動刪除過工作表的列）"""
+    global _user_table, _loaded_rows
+    with _index_lock:
+        _user_table = None
+        _loaded_rows = 0
+    _ensure_refresher()
+
+
+def refresh_user_index(sheet):
+    """只讀取上次載入之後新增的列（其他 worker 新增的用戶）"""
+    global _loaded_rows
+
+    start_row = _loaded_rows + 1
+    table = _new_table()
+    last_row = _read_rows(sheet, table, start_row)
+
+    with _index_lock:
+        if _user_table is None or _loaded_rows + 1 != start_row:
+            # 期間索引被清除或重新載入過
+            return 0
+        added = 0
+        for user_id, row_number, row in table.items():
+            added += _user_table.add(user_id, row_number, row)
+        _loaded_rows = max(_loaded_rows, last_row)
+        return added
+
+
+def reconcile_user_index(sheet):
+    """完整重新載入並取代索引，保留讀取期間本地寫入（或尚未寫入工作表）的用戶資料"""
+    global _user_table, _loaded_rows, _dirty_users
+
+    with _index_lock:
+        _dirty_users = set()
+    try:
+        table = _new_table()
+        last_row = _read_rows(sheet, table)
+        pending = crm_writer.pending_user_ids()
+
+        with _index_lock:
+            old_table = _user_table
+            if old_table is None:
+                # 第一次載入：讀取期間有寫入的用戶不能信任讀到的資料，交給下次查詢以 find 重讀
+                for user_id in _dirty_users | pending:
+                    if user_id in table:
+                        table.remove(user_id)
+            else:
+                for user_id in _dirty_users | pending:
+                    entry = old_table.get(user_id)
+                    if entry is None:
+                        continue
+                    if user_id in table:
+                        # 工作表上的資料可能還沒包含本地的寫入
+                        table.set_row(user_id, entry[1])
+                    else:
+                        table.add(user_id, entry[0], entry[1])
+            _user_table = table
+            _loaded_rows = last_row
+    finally:
+        with _index_lock:
+            _dirty_users = None
+
+
+def _mark_dirty(user_id):
+    """載入或完整重新載入期間記錄有本地寫入的用戶（呼叫端需持有 _index_lock）"""
+    if _dirty_users is not None:
+        _dirty_users.add(user_id)
+
+
+def _ensure_refresher():
+    """啟動背景載入與更新執行緒（第一次使用時才啟動，避免在 gunicorn fork 前建立執行緒）"""
+    global _refresher
+    if _user_table is not None and CRM_INDEX_REFRESH_INTERVAL <= 0:
+        return
+    if _refresher is not None and _refresher.is_alive():
+        return
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(
+                target=_refresh_loop, name="crm-index-refresh", daemon=True
+            )
+            _refresher.start()
+
+
+def _touch_append_marker():
+    """通知同一台主機的其他 worker 工作表有新增的列"""
+    try:
+        with open(CRM_INDEX_MARKER_PATH, "a"):
+            os.utime(CRM_INDEX_MARKER_PATH)
+    except OSError as e:
+        print(f"更新新增列標記錯誤: {e}")
+
+
+def _append_marker():
+    """新增列標記的修改時間（尚未有 worker 新增過列時為 0）"""
+    try:
+        return os.stat(CRM_INDEX_MARKER_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _refresh_loop():
+    """背景執行緒：索引尚未載入時先載入（失敗時稍後重試），之後每 CRM_INDEX_REFRESH_INTERVAL 秒
+    檢查新增列標記，有變動才讀取新增的列，每隔 CRM_INDEX_RECONCILE_INTERVAL 秒完整重新載入；
+    全部使用背景配額。沒有新增列時不會呼叫 Google Sheets API
+    """
+    last_reconcile = time.monotonic()
+    seen_marker = None
+    while True:
+        if _user_table is not None:
+            if CRM_INDEX_REFRESH_INTERVAL <= 0:
+                return
+            time.sleep(CRM_INDEX_REFRESH_INTERVAL)
+        sheet = get_sheet()
+        if sheet is None:
+            time.sleep(_LOAD_RETRY_SECONDS)
+            continue
+        # 先讀標記再讀工作表：讀取期間的新增會在下一輪看到標記變動
+        marker = _append_marker()
+        try:
+            with sheets_quota.background():
+                if _user_table is None:
+                    reconcile_user_index(sheet)
+                    last_reconcile = time.monotonic()
+                elif (CRM_INDEX_RECONCILE_INTERVAL > 0
+                        and time.monotonic() - last_reconcile >= CRM_INDEX_RECONCILE_INTERVAL):
+                    reconcile_user_index(sheet)
+                    last_reconcile = time.monotonic()
+                elif marker != seen_marker:
+                    refresh_user_index(sheet)
+            seen_marker = marker
+        except Exception as e:
+            print(f"更新用戶索引錯誤: {e}")
+            if _user_table is None:
+                time.sleep(_LOAD_RETRY_SECONDS)
+
+
+def _lookup_user(sheet, user_id, refresh=True):
+    """取得用戶的 (列號, 列資料)，找不到回傳 None
+
+    已完成註冊的列直接由索引回傳；尚在註冊中的列只重讀該列，
+    讓其他 worker 寫入的姓名能被看到（只需要列號的寫入可傳 refresh=False）。
+    索引未命中或尚未載入完成時退回 sheet.find。
+    """
+    with _index_lock:
+        entry = _user_table.get(user_id) if _user_table is not None else None
+    if _user_table is None:
+        _ensure_refresher()
+
+    if entry is not None:
+        if refresh and not _is_row_complete(entry[1]):
+            row = _pad_row(sheet.row_values(entry[0]))
+            if row[0] == user_id:
+                with _index_lock:
+                    if _user_table is not None:
+                        _user_table.set_row(user_id, row)
+                return entry[0], row
+            # 列已被移動（排序、插入或刪除列），改用 sheet.find 重新定位
+            _forget_user(user_id)
+        else:
+            return entry
+
+    # 可能是其他 worker 新增的列
+    cell = sheet.find(user_id)
+    if cell is None:
+        return None
+
+    row = _pad_row(sheet.row_values(cell.row))
+    with _index_lock:
+        if _user_table is not None:
+            _user_table.add(user_id, cell.row, row)
+    return cell.row, row
+
+
+def _forget_user(user_id):
+    """從索引移除用戶，下次查詢時以 sheet.find 重新定位"""
+    with _index_lock:
+        if _user_table is not None and user_id in _user_table:
+            _user_table.remove(user_id)
+            _mark_dirty(user_id)
+
+
+def _moved_rows(sheet, rows):
+    """以一次 batch_get 讀取 A 欄，確認快取的列號仍屬於該用戶，回傳已移動的 user_id
+
+    rows: user_id -> 列號。工作表會被手動排序、插入或刪除列，寫入前必須確認。
+    """
+    user_ids = list(rows)
+    values = sheet.batch_get([f"A{rows[user_id]}" for user_id in user_ids])
+    moved = []
+    for user_id, value in zip(user_ids, values):
+        if not value or not value[0] or value[0][0] != user_id:
+            moved.append(user_id)
+    return moved
+
+
+def _cache_cells(user_id, fields):
+    """寫入成功後同步更新索引中的列資料"""
+    with _index_lock:
+        _mark_dirty(user_id)
+        if _user_table is None:
+            return
+        _user_table.set_cells(user_id, {
+            FIELD_COLUMNS[field] - 1: value for field, value in fields.items()
+        })
+
+
+def _appended_row_numbers(response, count):
+    """從 append 回應的 updatedRange 取得新增的 count 個列號，無法得知時回傳 None"""
+    updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    if match is None:
+        return None
+    first_row = int(match.group(1))
+    return list(range(first_row, first_row + count))
+
+
+def _cache_appended_rows(items, response):
+    """append 成功後，從回應的 updatedRange 取得列號並更新索引
+
+    items: [(user_id, row), ...]，順序與新增的列相同
+    """
+    row_numbers = _appended_row_numbers(response, len(items))
+
+    with _index_lock:
+        for user_id, _ in items:
+            _mark_dirty(user_id)
+        if _user_table is None:
+            return
+        if row_numbers is None:
+            # 無法得知列號時交給下次查詢以 sheet.find 補上
+            return
+        for row_number, (user_id, row) in zip(row_numbers, items):
+            # 重複新增時與 sheet.find 一致，保留最早的列
+            _user_table.add(user_id, row_number, _pad_row(row))
+
+
+def _primary():
+    """主要儲存：CRM_BACKEND=sqlite 時為本地資料庫，否則為 Google Sheets 工作表"""
+    if CRM_BACKEND == "sqlite":
+        return crm_store.get_store()
+    return get_sheet()
+
+
+def _find_user(store, user_id, refresh=True):
+    """由主要儲存取得用戶的 (列號, 列資料)，找不到回傳 None"""
+    if CRM_BACKEND == "sqlite":
+        row = store.get(user_id)
+        return None if row is None else (None, list(row))
+    return _lookup_user(store, user_id, refresh)
+
+
+def _append_row(store, user_id, row):
+    """新增一列（回覆前同步寫入，其他 worker 的 sheet.find 立即找得到）"""
+    if CRM_BACKEND == "sqlite":
+        return store.insert(user_id, row)
+
+    sheet = store
+    response = sheet.append_row(row)
+    _cache_appended_rows([(user_id, row)], response)
+    _touch_append_marker()
+    return True
+
+
+@metrics.timed()
+def append_user_rows(items):
+    """以單一 append_rows 新增多列（items: [(user_id, row), ...]），不使用用戶索引
+
+    回傳新增的列號 list（無法得知時每個元素為 None）、
+    False（確定沒有寫入：等不到配額或 429，可以直接重送）
+    或 None（結果不明，例如 5xx 時請求可能已寫入；重送前需先以 find 確認，避免重複的列）
+    """
     sheet = get_sheet()
     if sheet is None:
         return False
 
+    try:
+        response = sheet.append_rows([row for _, row in items])
+        return _appended_row_numbers(response, len(items)) or [None] * len(items)
+    except Exception as e:
+        print(f"批次新增錯誤: {e}")
+        if isinstance(e, sheets_quota.SheetsThrottled) or sheets_quota.status_code(e) == 429:
+            return False
+        return None
+
+
+def _row_to_dict(row):
+    """將列資料轉為欄位字典"""
+    return {field: row[column - 1] for field, column in FIELD_COLUMNS.items()}
+
+
+def registration_state(record):
+    """由用戶資料判斷註冊狀態"""
+    if record is None:
+        return None  # 不在註冊流程中
+
+    # 判斷狀態
+    if record["register_time"]:
+        return "completed"
+    elif record["name"]:
+        return "completed"  # 有姓名就算完成
+    else:
+        return "waiting_name"
+
+
+@metrics.timed()
+def add_user_registration(user_id, name):
+    """新增用戶註冊資料"""
+    store = _primary()
+    if store is None:
+        return False
+
     try:
         now = get_tw_time()
         row = [
@@ -72,74 +532,172 @@ def add_user_registration(user_id, name):
             "待追蹤",          # G: 客戶狀態
             ""                 # H: 備註
         ]
-        sheet.append_row(row)
-        return True
+        return _append_row(store, user_id, row)
     except Exception as e:
         print(f"寫入註冊資料錯誤: {e}")
         return False
 
 
+@metrics.timed()
 def update_test_result(user_id, score, level):
     """更新用戶測試結果"""
+    # 測試分數、等級、時間（D:F 欄）一次寫入
+    return update_user_fields(user_id, {
+        "score": score,
+        "level": level,
+        "test_time": get_tw_time(),
+    }, write_behind=CRM_WRITE_BEHIND)
+
+
+def rowcol_to_a1(row, col):
+    """(3, 2) -> 'B3'（與 gspread.utils.rowcol_to_a1 相同）"""
+    letters = ""
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return f"{letters}{row}"
+
+
+def _row_ranges(row_number, fields):
+    """將同一列要寫入的欄位依欄號合併成連續範圍（batch_update 的 data 格式）"""
+    groups = []
+    for column, value in sorted((FIELD_COLUMNS[field], value) for field, value in fields.items()):
+        if groups and groups[-1][0] + len(groups[-1][1]) == column:
+            groups[-1][1].append(value)
+        else:
+            groups.append([column, [value]])
+
+    data = []
+    for start, values in groups:
+        cell_range = rowcol_to_a1(row_number, start)
+        if len(values) > 1:
+            cell_range += ":" + rowcol_to_a1(row_number, start + len(values) - 1)
+        data.append({"range": cell_range, "values": [values]})
+    return data
+
+
+def _write_fields(sheet, rows, updates):
+    """以 batch_update 寫入多列的欄位，依 value_input_option 分成最多兩個請求
+
+    rows: user_id -> 列號；updates: user_id -> {欄位名稱: 值}
+    """
+    data = {"USER_ENTERED": [], "RAW": []}
+    for user_id, row_number in rows.items():
+        fields = updates[user_id]
+        data["USER_ENTERED"].extend(_row_ranges(row_number, {
+            field: value for field, value in fields.items() if field in USER_ENTERED_FIELDS
+        }))
+        data["RAW"].extend(_row_ranges(row_number, {
+            field: value for field, value in fields.items() if field not in USER_ENTERED_FIELDS
+        }))
+    for value_input_option, ranges in data.items():
+        if ranges:
+            sheet.batch_update(ranges, value_input_option=value_input_option)
+
+
+@metrics.timed()
+def batch_update_users(updates):
+    """以 batch_update 寫入多位用戶的欄位（時間與分數、其他欄位的 value_input_option 不同，最多兩個請求）
+
+    updates: user_id -> {欄位名稱: 值}
+    回傳實際寫入的 user_id 集合（找不到列的用戶會略過）；寫入失敗回傳 None
+    """
     sheet = get_sheet()
     if sheet is None:
-        return False
+        return None
 
     try:
-        # 找到用戶的列
-        cell = sheet.find(user_id)
-        if cell is None:
+        rows = {}
+        for user_id, fields in updates.items():
+            if not fields:
+                continue
+            entry = _lookup_user(sheet, user_id, refresh=False)
+            if entry is None:
+                continue
+            rows[user_id] = entry[0]
+
+        if rows:
+            for user_id in _moved_rows(sheet, rows):
+                # 索引中的列已不屬於此用戶，重新定位（找不到就略過）
+                _forget_user(user_id)
+                entry = _lookup_user(sheet, user_id, refresh=False)
+                if entry is None:
+                    del rows[user_id]
+                else:
+                    rows[user_id] = entry[0]
+
+        if rows:
+            _write_fields(sheet, rows, updates)
+            for user_id in rows:
+                _cache_cells(user_id, updates[user_id])
+        return set(rows)
+    except Exception as e:
+        print(f"批次更新錯誤: {e}")
+        return None
+
+
+@metrics.timed()
+def update_user_fields(user_id, fields, write_behind=False):
+    """以單一請求寫入同一列的多個欄位（fields: 欄位名稱 -> 值）
+
+    write_behind=True 時只更新索引並排入佇列，不等待 Google Sheets 回應；
+    只用於測試結果，註冊狀態必須在回覆前寫入，其他 worker 才看得到
+    """
+    if CRM_BACKEND == "sqlite":
+        store = _primary()
+        if store is None:
+            return False
+        try:
+            return store.update(user_id, fields)
+        except Exception as e:
+            print(f"更新用戶資料錯誤: {e}")
             return False
 
-        row = cell.row
-        now = get_tw_time()
+    if not write_behind:
+        written = batch_update_users({user_id: fields})
+        return bool(written) and user_id in written
 
-        # 更新測試分數、等級、時間
-        sheet.update_cell(row, 4, score)      # D 欄：測試分數
-        sheet.update_cell(row, 5, level)      # E 欄：測試等級
-        sheet.update_cell(row, 6, now)        # F 欄：測試時間
-        return True
+    sheet = get_sheet()
+    if sheet is None:
+        return False
+
+    try:
+        if _lookup_user(sheet, user_id, refresh=False) is None:
+            return False
+        _cache_cells(user_id, fields)
+        return crm_writer.submit_update(user_id, fields)
     except Exception as e:
-        print(f"更新測試結果錯誤: {e}")
+        print(f"更新用戶資料錯誤: {e}")
         return False
 
 
+@metrics.timed()
 def get_user_by_id(user_id):
     """根據 Line ID 取得用戶資料"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return None
 
     try:
-        cell = sheet.find(user_id)
-        if cell is None:
+        entry = _find_user(store, user_id)
+        if entry is None:
             return None
 
-        row = sheet.row_values(cell.row)
-        return {
-            "user_id": row[0] if len(row) > 0 else "",
-            "name": row[1] if len(row) > 1 else "",
-            "register_time": row[2] if len(row) > 2 else "",
-            "score": row[3] if len(row) > 3 else "",
-            "level": row[4] if len(row) > 4 else "",
-            "test_time": row[5] if len(row) > 5 else "",
-            "status": row[6] if len(row) > 6 else "",
-            "note": row[7] if len(row) > 7 else ""
-        }
+        return _row_to_dict(entry[1])
     except Exception as e:
         print(f"查詢用戶錯誤: {e}")
         return None
 
 
+@metrics.timed()
 def is_user_exists(user_id):
     """檢查用戶是否已存在"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return False
 
     try:
-        cell = sheet.find(user_id)
-        return cell is not None
+        return _find_user(store, user_id, refresh=False) is not None
     except Exception as e:
         print(f"檢查用戶錯誤: {e}")
         return False
@@ -147,19 +705,19 @@ def is_user_exists(user_id):
 
 # ===== 註冊狀態管理（持久化） =====
 
+@metrics.timed()
 def start_registration_persistent(user_id):
     """開始註冊流程（寫入 Google Sheets）"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return False
 
     try:
         # 檢查是否已存在
-        cell = sheet.find(user_id)
-        if cell is not None:
+        entry = _find_user(store, user_id)
+        if entry is not None:
             # 已存在，檢查是否已完成註冊
-            row = sheet.row_values(cell.row)
-            register_time = row[2] if len(row) > 2 else ""
+            register_time = entry[1][2]
             if register_time:
                 # 已完成註冊
                 return "already_registered"
@@ -177,27 +735,27 @@ def start_registration_persistent(user_id):
             "註冊中",   # G: 客戶狀態
             ""          # H: 備註
         ]
-        sheet.append_row(row)
-        return True
+        return _append_row(store, user_id, row)
     except Exception as e:
         print(f"開始註冊錯誤: {e}")
         return False
 
 
+@metrics.timed()
 def get_registration_state_persistent(user_id):
     """取得註冊狀態（從 Google Sheets）"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return None
 
     try:
-        cell = sheet.find(user_id)
-        if cell is None:
+        entry = _find_user(store, user_id)
+        if entry is None:
             return None  # 不在註冊流程中
 
-        row = sheet.row_values(cell.row)
-        name = row[1] if len(row) > 1 else ""
-        register_time = row[2] if len(row) > 2 else ""
+        row = entry[1]
+        name = row[1]
+        register_time = row[2]
 
         # 判斷狀態
         if register_time:
@@ -211,42 +769,29 @@ def get_registration_state_persistent(user_id):
         return None
 
 
+@metrics.timed()
 def update_registration_name(user_id, name):
     """更新註冊姓名"""
-    sheet = get_sheet()
-    if sheet is None:
-        return False
-
-    try:
-        cell = sheet.find(user_id)
-        if cell is None:
-            return False
-
-        sheet.update_cell(cell.row, 2, name)  # B 欄：姓名
-        return True
-    except Exception as e:
-        print(f"更新姓名錯誤: {e}")
-        return False
+    return update_user_fields(user_id, {"name": name})  # B 欄：姓名
 
 
+@metrics.timed()
 def complete_registration_persistent(user_id, payment_code=None):
     """完成註冊（更新註冊時間）"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return None
 
     try:
-        cell = sheet.find(user_id)
-        if cell is None:
+        entry = _find_user(store, user_id)
+        if entry is None:
             return None
 
-        row = sheet.row_values(cell.row)
-        name = row[1] if len(row) > 1 else ""
-        now = get_tw_time()
+        name = entry[1][1]
 
-        # 更新註冊時間、狀態
-        sheet.update_cell(cell.row, 3, now)           # C 欄：註冊時間
-        sheet.update_cell(cell.row, 7, "待追蹤")      # G 欄：客戶狀態
+        # 更新註冊時間（C 欄）、狀態（G 欄），一次寫入
+        if not update_user_fields(user_id, {"register_time": get_tw_time(), "status": "待追蹤"}):
+            return None
 
         return {"name": name}
     except Exception as e:
@@ -254,19 +799,19 @@ def complete_registration_persistent(user_id, payment_code=None):
         return None
 
 
+@metrics.timed()
 def get_user_name(user_id):
     """取得用戶姓名"""
-    sheet = get_sheet()
-    if sheet is None:
+    store = _primary()
+    if store is None:
         return None
 
     try:
-        cell = sheet.find(user_id)
-        if cell is None:
+        entry = _find_user(store, user_id)
+        if entry is None:
             return None
 
-        row = sheet.row_values(cell.row)
-        return row[1] if len(row) > 1 else None
+        return entry[1][1]
     except Exception as e:
         print(f"取得姓名錯誤: {e}")
         return None
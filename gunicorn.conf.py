@@ -0,0 +1,52 @@
+"""gunicorn 設定（gunicorn 會自動讀取工作目錄下的 gunicorn.conf.py）"""
+import multiprocessing
+import os
+import time
+
+from config import SESSION_BACKEND, GUNICORN_PRELOAD
+
+# memory 模式的測試進度只存在單一 process，只能開一個 worker；
+# sqlite 模式由所有 worker 共用，可以用滿所有核心
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY",
+    multiprocessing.cpu_count() if SESSION_BACKEND == "sqlite" else 1,
+))
+
+# master 先載入 app，worker fork 後共用已建立的狀態
+preload_app = GUNICORN_PRELOAD
+
+
+def when_ready(server):
+    """preload 時 master 在第一次 fork worker 前建立共用的唯讀狀態"""
+    if GUNICORN_PRELOAD:
+        from app import preload
+        started = time.perf_counter()
+        users = preload()
+        server.log.info("preload 完成：%d 位用戶，%.2f 秒", users, time.perf_counter() - started)
+
+
+def post_worker_init(worker):
+    """worker 啟動後在背景載入 Google Sheets 用戶索引與 LINE SDK；PROFILER_ENABLED 時開始取樣
+
+    Google Sheets 配額依 worker 數分攤；索引以背景配額載入，不會拖過 gunicorn 的 timeout，
+    載入完成前查詢退回 sheet.find；preload 時索引已在 master 載入，這裡只啟動背景更新
+    """
+    import threading
+    import sheets_quota
+    from app import warm_imports
+    from google_sheets import warm_user_index
+    from profiler import start_from_env
+    sheets_quota.configure(worker.cfg.workers)
+    threading.Thread(target=warm_imports, name="warm-imports", daemon=True).start()
+    warm_user_index()
+    start_from_env()
+
+
+def worker_exit(server, worker):
+    """worker 結束前處理完排隊的事件、送出尚未寫入 Google Sheets 的資料並關閉 LINE 連線池"""
+    from crm_writer import drain
+    from event_executor import shutdown
+    from line_client import close_messaging_api
+    shutdown()
+    drain()
+    close_messaging_api()
@@ -0,0 +1,80 @@
+"""LINE Messaging API 共用連線
+
+每個 worker 共用一個 ApiClient（內含 urllib3 連線池），回覆訊息時不必每次重新建立
+連線與 TLS 交握。連線池可同時給多個執行緒使用。
+"""
+import atexit
+import os
+import socket
+import threading
+
+import metrics
+from config import (
+    LINE_CHANNEL_ACCESS_TOKEN,
+    LINE_API_POOL_SIZE,
+    LINE_API_KEEPALIVE_IDLE,
+    LINE_API_HOST,
+)
+
+_api_client = None
+_messaging_api = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _socket_options():
+    """開啟 TCP keep-alive，避免閒置的連線被中間設備切斷"""
+    from urllib3.connection import HTTPConnection
+
+    options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, LINE_API_KEEPALIVE_IDLE),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(LINE_API_KEEPALIVE_IDLE // 4, 1)),
+        ]
+    return options
+
+
+def get_messaging_api():
+    """取得本 worker 共用的 MessagingApi（第一次使用時建立連線池）"""
+    global _api_client, _messaging_api, _pid
+
+    # fork 出來的 worker 不能沿用父 process 的連線
+    if _messaging_api is not None and _pid == os.getpid():
+        return _messaging_api
+
+    with _lock:
+        if _messaging_api is None or _pid != os.getpid():
+            # linebot.v3.messaging 載入較久，第一次使用時才 import
+            from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
+
+            configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+            configuration.connection_pool_maxsize = LINE_API_POOL_SIZE
+            configuration.socket_options = _socket_options()
+
+            _api_client = ApiClient(configuration)
+            _messaging_api = MessagingApi(_api_client)
+            if LINE_API_HOST:
+                _messaging_api.line_base_path = LINE_API_HOST
+            # 回覆時間記錄在 /metrics 的 reply_message 階段
+            _messaging_api.reply_message = metrics.timed("reply_message")(_messaging_api.reply_message)
+            _pid = os.getpid()
+    return _messaging_api
+
+
+def close_messaging_api():
+    """關閉連線池（worker 結束前呼叫）"""
+    global _api_client, _messaging_api, _pid
+
+    with _lock:
+        if _api_client is not None and _pid == os.getpid():
+            _api_client.close()
+            _api_client.rest_client.pool_manager.clear()
+        _api_client = None
+        _messaging_api = None
+        _pid = None
+
+
+atexit.register(close_messaging_api)
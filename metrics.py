@@ -0,0 +1,189 @@
+"""Prometheus 文字格式的指標（GET /metrics）
+
+- wealth_navigator_stage_seconds：callback 各階段（驗證簽章、解析事件、註冊查詢、
+  process_answer、建立 Flex、reply_message、每個 google_sheets 函式）的處理時間，
+  發生例外的次數另記在 wealth_navigator_stage_errors_total
+- wealth_navigator_sheets_requests_total / _sheets_request_seconds：每次 Google Sheets API
+  請求，依操作（get、batch_update、append_rows...）與結果（ok、HTTP 狀態碼）分類
+- 各模組 stats() 的計數（register_stats 登記）
+
+stage() / timed() 在有進行中的 trace 時同時記錄一個同名的 span（tracing.py）。
+指標存在各 worker process 的記憶體內，多個 gunicorn worker 時每次抓取只看到回應的那個 worker。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+import tracing
+
+PREFIX = "wealth_navigator"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒；涵蓋記憶體內的查表（< 1 ms）到 Google Sheets 退避重試（數秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不減的計數，依標籤值分開"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in items:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """固定刻度的延遲分布（秒），依標籤值分開"""
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 標籤值 -> [各刻度的次數（最後一格為超過最大刻度）, 總和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(f"{PREFIX}_stage_seconds", "callback 各階段的處理時間（秒）", ("stage",))
+STAGE_ERRORS = Counter(f"{PREFIX}_stage_errors_total", "各階段發生例外的次數", ("stage",))
+SHEETS_REQUESTS = Counter(
+    f"{PREFIX}_sheets_requests_total", "Google Sheets API 請求次數（含重試）", ("operation", "outcome")
+)
+SHEETS_REQUEST_SECONDS = Histogram(
+    f"{PREFIX}_sheets_request_seconds", "Google Sheets API 請求時間（秒，不含等待配額）", ("operation",)
+)
+
+_metrics = [STAGE_SECONDS, STAGE_ERRORS, SHEETS_REQUESTS, SHEETS_REQUEST_SECONDS]
+
+# (子系統名稱, 回傳 dict 的函式, 累計值的鍵)
+_collectors = []
+
+
+@contextmanager
+def stage(name):
+    """記錄 with 區塊的處理時間"""
+    span = tracing.start_span(name)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, name)
+        tracing.finish_span(span, error)
+
+
+def timed(name=None):
+    """記錄函式的處理時間（stage 預設為「模組.函式名稱」）"""
+    def decorator(func):
+        stage_name = name or f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 與 stage() 相同，但不經過 generator，每次呼叫較省
+            span = tracing.start_span(stage_name)
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                STAGE_ERRORS.inc(stage_name)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage_name)
+                tracing.finish_span(span, error)
+        return wrapper
+    return decorator
+
+
+def register_stats(subsystem, func, counters=()):
+    """將 func() 回傳的數值輸出為 {PREFIX}_{subsystem}_{鍵}；counters 中的鍵為累計值"""
+    _collectors.append((subsystem, func, frozenset(counters)))
+
+
+def _render_stats():
+    lines = []
+    for subsystem, func, counters in _collectors:
+        try:
+            values = func()
+        except Exception as e:
+            print(f"收集 {subsystem} 指標錯誤: {e}")
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{PREFIX}_{subsystem}_{key}"
+            kind = "gauge"
+            if key in counters:
+                name += "_total"
+                kind = "counter"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_number(value)}")
+    return lines
+
+
+def render():
+    """所有指標的 Prometheus 文字格式"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_stats())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,160 @@
+"""取樣 profiler（在執行中的 worker 內取樣堆疊）
+
+背景執行緒每 PROFILER_INTERVAL 秒以 sys._current_frames() 取樣所有執行緒的堆疊，
+取樣一段固定時間後輸出 folded stacks（每行「frame;frame;... 次數」），
+可直接給 flamegraph.pl 或 speedscope 產生火焰圖。
+
+- 以牆上時間取樣：等待 Google Sheets 或 LINE 回應的時間也會出現在堆疊中
+- 只保留經過本專案程式碼的堆疊（app.handle_*、google_sheets...），略過 gunicorn 等待連線等
+- 關閉時沒有任何執行緒或攔截，請求路徑不受影響；只取樣收到請求的那個 worker
+
+開啟方式：PROFILER_ENABLED=1（worker 啟動後持續取樣，保留最近 PROFILER_KEEP 個檔案），
+或設定 PROFILER_ADMIN_TOKEN 後：
+  curl -X POST -H "Authorization: Bearer $TOKEN" "http://host/admin/profile?seconds=30"
+  curl -H "Authorization: Bearer $TOKEN" http://host/admin/profile > profile.folded
+"""
+import glob
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import (
+    PROFILER_ENABLED,
+    PROFILER_WINDOW_SECONDS,
+    PROFILER_INTERVAL,
+    PROFILER_DIR,
+    PROFILER_KEEP,
+    PROFILER_ADMIN_TOKEN,
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAX_SECONDS = 600
+
+_lock = threading.Lock()
+_thread = None
+_running_until = None
+_last_path = None
+
+
+def _frame_label(code):
+    label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    return label.replace(";", ":").replace(" ", "_")
+
+
+def _fold(frame):
+    """堆疊 -> 由外而內以 ; 連接；沒有經過本專案程式碼的堆疊回傳 None"""
+    labels = []
+    ours = False
+    while frame is not None:
+        code = frame.f_code
+        if not ours and code.co_filename.startswith(ROOT) and "/benchmarks/" not in code.co_filename:
+            ours = True
+        labels.append(_frame_label(code))
+        frame = frame.f_back
+    if not ours:
+        return None
+    labels.reverse()
+    return ";".join(labels)
+
+
+def sample(seconds, interval=PROFILER_INTERVAL):
+    """在目前執行緒取樣其他執行緒 seconds 秒，回傳 (Counter(堆疊 -> 次數), 取樣次數)"""
+    me = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = _fold(frame)
+            if stack:
+                stacks[stack] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def _write(stacks):
+    """寫出 folded stacks 檔，回傳路徑"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(PROFILER_DIR, f"wealth_navigator_profile_{os.getpid()}_{stamp}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def _cleanup():
+    """只保留本 worker 最近的 PROFILER_KEEP 個檔案"""
+    pattern = os.path.join(PROFILER_DIR, f"wealth_navigator_profile_{os.getpid()}_*.folded")
+    for path in sorted(glob.glob(pattern))[:-PROFILER_KEEP or None]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _run(seconds, continuous):
+    global _running_until, _last_path
+    try:
+        while True:
+            stacks, samples = sample(seconds)
+            _last_path = _write(stacks)
+            print(f"profiler: {samples} 次取樣，已寫入 {_last_path}")
+            if not continuous:
+                break
+            _cleanup()
+            _running_until = time.time() + seconds
+    except Exception as e:
+        print(f"profiler 錯誤: {e}")
+    finally:
+        with _lock:
+            _running_until = None
+
+
+def start(seconds=PROFILER_WINDOW_SECONDS, continuous=False):
+    """開始取樣 seconds 秒（已在取樣中回傳 False）"""
+    global _thread, _running_until
+    seconds = min(max(seconds, PROFILER_INTERVAL), MAX_SECONDS)
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _running_until = time.time() + seconds
+        _thread = threading.Thread(target=_run, args=(seconds, continuous), name="profiler", daemon=True)
+        _thread.start()
+    return True
+
+
+def start_from_env():
+    """PROFILER_ENABLED=1 時開始持續取樣（worker fork 之後呼叫）"""
+    if PROFILER_ENABLED:
+        start(PROFILER_WINDOW_SECONDS, continuous=True)
+
+
+def status():
+    """是否正在取樣與最近一次的輸出檔"""
+    return {
+        "pid": os.getpid(),
+        "running": _running_until is not None,
+        "until": _running_until,
+        "last_output": _last_path,
+    }
+
+
+def last_output():
+    """最近一次取樣的 folded stacks（沒有時回傳 None）"""
+    if _last_path is None or not os.path.exists(_last_path):
+        return None
+    with open(_last_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def authorized(header):
+    """Authorization: Bearer <PROFILER_ADMIN_TOKEN>；未設定 token 時一律拒絕"""
+    if not PROFILER_ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(header.encode("utf-8"), f"Bearer {PROFILER_ADMIN_TOKEN}".encode("utf-8"))
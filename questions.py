@@ -1,3 +1,6 @@
+from collections import namedtuple
+from types import MappingProxyType
+
 QUESTIONS = [
     # 第一部分：金錢安全感
     {
@@ -97,6 +100,135 @@ QUESTIONS = [
     },
 ]
 
-# 計分題：Q1(1-10) + Q2(1-6) + Q3(1-10) + Q4(1-6) + Q6(1-10) = 5-42 分
-MAX_SCORE = 42
-MIN_SCORE = 5
+# 測試結果等級：(最低分數, 等級, 診斷, 建議)，由高分到低分
+RESULT_LEVELS = (
+    (
+        29,
+        "🟢【綠色穩健】財富方舟族",
+        "您已經具備基礎的財富配置架構。",
+        "下一階段應關注「資產傳承」與「極致避險」，優化您的實體資產比例。",
+    ),
+    (
+        16,
+        "🟡【黃色轉型】財富焦慮族",
+        "您有一定的理財意識，但工具過於單一（可能只有存款或股票）。在動盪時期，您的資產波動會讓您睡不著覺。",
+        "建議導入「自動化配置工具」，平衡風險與收益。",
+    ),
+    (
+        0,
+        "🔴【紅色警戒】財富裸奔族",
+        "您的財富極度缺乏防火牆，一旦通膨加速或收入中斷，生活品質會迅速滑落。",
+        "您目前最需要的是建立「緊急防禦資產」，先學會鎖住財富價值。",
+    ),
+)
+
+# 多選題「完成選擇」的關鍵字
+COMPLETION_KEYWORDS = frozenset(["完成", "完成選擇", "OK", "ok", "下一題", "好了", "確定"])
+
+# 選項代號（A, B, C, D）
+OPTION_LETTERS = "ABCD"
+
+
+# ===== 編譯後的題目（import 時建立一次，之後只做查表） =====
+
+CompiledQuestion = namedtuple("CompiledQuestion", [
+    "index",         # 題目索引
+    "question",      # 原始題目 dict
+    "is_multiple",   # 是否為多選題
+    "scored",        # 是否為計分題
+    "show_part",     # 是否為該部分的第一題（需要顯示 part 標題）
+    "letter_index",  # 選項代號 -> 選項索引
+    "text_index",    # 選項文字的任一子字串 -> 第一個包含它的選項索引
+    "scores",        # 各選項分數
+    "values",        # 各選項記錄到 profile 的值
+    "selections",    # 多選題：位元遮罩 -> 已選的選項值
+])
+
+
+def _compile_question(index, question, previous):
+    """將單一題目編譯為查表結構"""
+    options = question["options"]
+    if len(options) > len(OPTION_LETTERS):
+        raise ValueError(f"Q{index + 1} 選項超過 {len(OPTION_LETTERS)} 個")
+
+    # 與逐一比對 `answer in label` 的結果相同：先出現的選項優先
+    text_index = {}
+    for i, option in enumerate(options):
+        label = option["label"]
+        for start in range(len(label) + 1):
+            for end in range(start, len(label) + 1):
+                text_index.setdefault(label[start:end], i)
+
+    values = tuple(option.get("value", option["label"]) for option in options)
+    is_multiple = question.get("type") == "multiple"
+    selections = ()
+    if is_multiple:
+        selections = tuple(
+            tuple(value for i, value in enumerate(values) if mask & (1 << i))
+            for mask in range(1 << len(options))
+        )
+
+    return CompiledQuestion(
+        index=index,
+        question=question,
+        is_multiple=is_multiple,
+        scored=question.get("scored", True),
+        show_part=previous is None or previous.get("part", "") != question.get("part", ""),
+        letter_index=MappingProxyType({OPTION_LETTERS[i]: i for i in range(len(options))}),
+        text_index=MappingProxyType(text_index),
+        scores=tuple(option.get("score", 0) for option in options),
+        values=values,
+        selections=selections,
+    )
+
+
+def compile_questions(questions):
+    """編譯所有題目"""
+    compiled = []
+    previous = None
+    for index, question in enumerate(questions):
+        compiled.append(_compile_question(index, question, previous))
+        previous = question
+    return tuple(compiled)
+
+
+def _score_bounds(compiled):
+    """由計分題選項計算總分範圍"""
+    scored = [question.scores for question in compiled if question.scored]
+    return sum(min(scores) for scores in scored), sum(max(scores) for scores in scored)
+
+
+def _compile_levels(levels, min_score, max_score):
+    """建立「分數 -> (等級, 診斷, 建議)」對照表，並檢查門檻落在分數範圍內"""
+    thresholds = [level[0] for level in levels]
+    if thresholds != sorted(thresholds, reverse=True) or thresholds[-1] > min_score:
+        raise ValueError("RESULT_LEVELS 門檻需由高到低，且最低門檻不可高於最低分")
+    for threshold in thresholds[:-1]:
+        if not min_score < threshold <= max_score:
+            raise ValueError(f"RESULT_LEVELS 門檻 {threshold} 超出分數範圍 {min_score}-{max_score}")
+
+    table = []
+    for score in range(max_score + 1):
+        level = next(level for level in levels if score >= level[0])
+        table.append(level[1:])
+    return tuple(table)
+
+
+COMPILED_QUESTIONS = compile_questions(QUESTIONS)
+
+# 計分題總分範圍（目前為 Q1 + Q2 + Q3 + Q4 + Q6 = 5-42 分）
+MIN_SCORE, MAX_SCORE = _score_bounds(COMPILED_QUESTIONS)
+if MAX_SCORE > 255:
+    # SessionState 以一個 byte 儲存分數
+    raise ValueError(f"總分上限 {MAX_SCORE} 超過 255")
+
+LEVEL_BY_SCORE = _compile_levels(RESULT_LEVELS, MIN_SCORE, MAX_SCORE)
+
+
+def match_option(compiled, answer):
+    """將用戶輸入對應到選項索引，無法對應時回傳 None"""
+    answer_upper = answer.upper().strip()
+    if answer_upper and answer_upper[0] in OPTION_LETTERS:
+        # 以選項代號開頭（A、b、"C. ..."），超出該題選項數即無效
+        return compiled.letter_index.get(answer_upper[0])
+    return compiled.text_index.get(answer)
@@ -0,0 +1,285 @@
+"""測試進度（session）儲存
+
+memory：單一 process 內的 dict（預設）
+sqlite：同一台機器上多個 gunicorn worker 共用的 SQLite（WAL 模式）
+
+兩者都會淘汰閒置超過 ttl 秒的 session，並在超過 max_entries 筆時淘汰最久未使用的。
+淘汰只處理最舊的幾筆，不會在請求中掃描整個儲存。
+
+每筆 session 帶有版本號，每次寫入加一；get_versioned 與 compare_and_set
+讓多個 process 同時修改同一用戶時，只有一方成功，另一方重讀後重試。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import SESSION_BACKEND, SESSION_DB_PATH, SESSION_TTL_SECONDS, SESSION_MAX_ENTRIES
+
+
+class MemorySessionStore:
+    """process 內的 session 儲存（只適用單一 worker）"""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user_id -> [session, 最後使用時間, 版本]，依最後使用時間由舊到新排列
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _is_expired(self, entry, now):
+        return now - entry[1] > self.ttl
+
+    def get(self, user_id):
+        return self.get_versioned(user_id)[0]
+
+    def get_versioned(self, user_id):
+        """回傳 (session, 版本)，不存在時為 (None, None)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                return None, None
+            if self._is_expired(entry, now):
+                del self._sessions[user_id]
+                self.expired += 1
+                return None, None
+            entry[1] = now
+            self._sessions.move_to_end(user_id)
+            return entry[0], entry[2]
+
+    def set(self, user_id, session):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            version = entry[2] + 1 if entry is not None else 0
+            self._sessions[user_id] = [session, now, version]
+            self._sessions.move_to_end(user_id)
+            self._evict(now)
+
+    def compare_and_set(self, user_id, session, version):
+        """只有目前版本仍為 version 時才寫入（version 為 None 表示原本不存在）"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            current = entry[2] if entry is not None else None
+            if current != version:
+                return False
+            self._sessions[user_id] = [session, now, 0 if version is None else version + 1]
+            self._sessions.move_to_end(user_id)
+            self._evict(now)
+            return True
+
+    def _evict(self, now):
+        """從最舊的一端淘汰：過期的，以及超過筆數上限的"""
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if not self._is_expired(oldest, now):
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def delete(self, user_id, version=None):
+        """刪除 session；指定 version 時只有版本相符才刪除"""
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None or (version is not None and entry[2] != version):
+                return False
+            del self._sessions[user_id]
+            return True
+
+    def __contains__(self, user_id):
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            return entry is not None and not self._is_expired(entry, time.monotonic())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        """目前筆數與淘汰次數（expired：閒置過期，evicted：超過上限）"""
+        return {"size": len(self), "expired": self.expired, "evicted": self.evicted}
+
+
+def ensure_row_counter(conn, table):
+    """以觸發器在 {table}_count 維護筆數，淘汰時不必以 COUNT(*) 掃描整張表
+
+    第一次建立時在同一個交易內計數一次；多個 process 同時建立時只有一個會寫入初始值
+    """
+    counter = f"{table}_count"
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {counter} (n INTEGER NOT NULL)")
+        if conn.execute(f"SELECT 1 FROM {counter}").fetchone() is None:
+            conn.execute(f"INSERT INTO {counter} SELECT COUNT(*) FROM {table}")
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table}"
+            f" BEGIN UPDATE {counter} SET n = n + 1; END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table}"
+            f" BEGIN UPDATE {counter} SET n = n - 1; END"
+        )
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def row_count(conn, table):
+    """ensure_row_counter 維護的筆數"""
+    return conn.execute(f"SELECT n FROM {table}_count").fetchone()[0]
+
+
+class SQLiteSessionStore:
+    """以 SQLite（WAL 模式）在多個 worker process 間共用 session"""
+
+    # 每寫入幾次做一次淘汰
+    EVICT_EVERY = 100
+
+    def __init__(self, path, encode=json.dumps, decode=json.loads,
+                 ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._encode = encode
+        self._decode = decode
+        self._local = threading.local()
+        self._writes = 0
+        # 淘汰次數為本 process 的統計
+        self.expired = 0
+        self.evicted = 0
+
+    def _connection(self):
+        """每個執行緒各自一條連線；fork 後的新 process 會重新連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id TEXT PRIMARY KEY,"
+                " data BLOB NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                # 舊版資料表沒有版本欄位
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)"
+            )
+            ensure_row_counter(conn, "sessions")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, user_id):
+        return self.get_versioned(user_id)[0]
+
+    def get_versioned(self, user_id):
+        """回傳 (session, 版本)，不存在時為 (None, None)"""
+        row = self._connection().execute(
+            "SELECT data, updated_at, version FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        if time.time() - row[1] > self.ttl:
+            if self.delete(user_id, row[2]):
+                self.expired += 1
+            return None, None
+        return self._decode(row[0]), row[2]
+
+    def set(self, user_id, session):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET"
+            " data = excluded.data, updated_at = excluded.updated_at, version = version + 1",
+            (user_id, self._encode(session), time.time()),
+        )
+        self._after_write(conn)
+
+    def compare_and_set(self, user_id, session, version):
+        """只有目前版本仍為 version 時才寫入（version 為 None 表示原本不存在）"""
+        conn = self._connection()
+        if version is None:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, self._encode(session), time.time()),
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE sessions SET data = ?, updated_at = ?, version = version + 1"
+                " WHERE user_id = ? AND version = ?",
+                (self._encode(session), time.time(), user_id, version),
+            )
+        if cursor.rowcount != 1:
+            return False
+        self._after_write(conn)
+        return True
+
+    def _after_write(self, conn):
+        """每寫入 EVICT_EVERY 次做一次淘汰"""
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """刪除過期的 session，以及超過筆數上限時最久未更新的（依 updated_at 索引，筆數由觸發器維護）"""
+        cursor = conn.execute(
+            "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)
+        )
+        self.expired += max(cursor.rowcount, 0)
+
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE user_id IN ("
+                " SELECT user_id FROM sessions ORDER BY updated_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evicted += max(cursor.rowcount, 0)
+
+    def delete(self, user_id, version=None):
+        """刪除 session；指定 version 時只有版本相符才刪除"""
+        if version is None:
+            cursor = self._connection().execute(
+                "DELETE FROM sessions WHERE user_id = ?", (user_id,)
+            )
+        else:
+            cursor = self._connection().execute(
+                "DELETE FROM sessions WHERE user_id = ? AND version = ?", (user_id, version)
+            )
+        return cursor.rowcount > 0
+
+    def __contains__(self, user_id):
+        row = self._connection().execute(
+            "SELECT 1 FROM sessions WHERE user_id = ? AND updated_at >= ?",
+            (user_id, time.time() - self.ttl),
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return row_count(self._connection(), "sessions")
+
+    def stats(self):
+        """目前筆數與本 process 的淘汰次數（expired：閒置過期，evicted：超過上限）"""
+        return {"size": len(self), "expired": self.expired, "evicted": self.evicted}
+
+
+def create_session_store(encode=json.dumps, decode=json.loads):
+    """依 SESSION_BACKEND 建立 session 儲存"""
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_PATH, encode=encode, decode=decode)
+    return MemorySessionStore()
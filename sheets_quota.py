@@ -0,0 +1,238 @@
+"""Google Sheets 配額控管
+
+所有工作表操作都先向 token bucket 取得額度：容量加上 60 秒的補充量等於每分鐘配額，
+任何 60 秒內都不會超過；gunicorn 下依 worker 數分攤（configure()）。背景寫入（crm_writer）不能動用保留給互動請求的額度，且有互動請求在等待時先讓出；
+遇到 429 或 5xx 以加上隨機抖動的指數退避重試。
+
+計數（呼叫、等待額度、429、重試、失敗）可由 stats() 取得；
+每次請求依操作與結果記錄在 metrics（/metrics），追蹤中的事件另記一個 span。
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import tracing
+from config import (
+    SHEETS_QUOTA_PER_MINUTE,
+    SHEETS_QUOTA_BURST,
+    SHEETS_INTERACTIVE_RESERVE,
+    SHEETS_INTERACTIVE_TIMEOUT,
+    SHEETS_MAX_RETRIES,
+    SHEETS_BACKOFF_BASE,
+    SHEETS_BACKOFF_MAX,
+)
+
+# 會新增列的操作：只有 429（確定未寫入）才重試，避免 5xx 時重複新增
+NON_IDEMPOTENT = frozenset(("append_row", "append_rows", "insert_row", "insert_rows"))
+
+# 有互動請求在等待時，背景請求重新檢查的間隔（秒）
+_POLL_INTERVAL = 0.05
+
+
+class SheetsThrottled(Exception):
+    """等待 Google Sheets 配額逾時"""
+
+
+class TokenBucket:
+    """每秒補充 rate 個、最多 capacity 個的額度；背景請求不能用掉最後 reserve 個"""
+
+    def __init__(self, rate, capacity, reserve=0):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, background=False, deadline=None):
+        """取得一個額度，回傳等待秒數；超過 deadline（monotonic）仍取不到回傳 None"""
+        started = time.monotonic()
+        waiting = False
+        slept = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if background:
+                        # 有互動請求在等時不跟它搶
+                        floor = self.capacity if self._interactive_waiting else self.reserve
+                    else:
+                        floor = 0
+                    if self._tokens - floor >= 1:
+                        self._tokens -= 1
+                        return now - started if slept else 0.0
+                    if not background and not waiting:
+                        waiting = True
+                        self._interactive_waiting += 1
+                    if background and self._interactive_waiting:
+                        # 互動請求取得額度前不會輪到背景請求，短暫等待後再檢查
+                        delay = _POLL_INTERVAL
+                    else:
+                        delay = (floor + 1 - self._tokens) / self.rate
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    delay = min(delay, remaining)
+                time.sleep(max(delay, 0.001))
+                slept = True
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+
+    def drain(self):
+        """收到 429 時清空額度，讓所有請求一起放慢"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0)
+
+
+def _new_bucket(quota):
+    """每分鐘 quota 個請求的額度：容量 + 60 秒的補充量 = quota"""
+    capacity = max(1.0, quota * SHEETS_QUOTA_BURST)
+    rate = (quota - capacity) / 60.0
+    if rate <= 0:
+        print(f"Google Sheets 配額分攤後每個 process 每分鐘只有 {quota:g} 次，請調高配額或減少 worker")
+        rate = quota / 60.0
+    # 背景請求至少要能用到 1 個額度
+    reserve = min(capacity * SHEETS_INTERACTIVE_RESERVE, capacity - 1)
+    return TokenBucket(rate=rate, capacity=capacity, reserve=reserve)
+
+
+_bucket = _new_bucket(SHEETS_QUOTA_PER_MINUTE)
+
+
+def configure(processes):
+    """依同時使用配額的 process 數分攤 SHEETS_QUOTA_PER_MINUTE（gunicorn worker 啟動時呼叫）"""
+    global _bucket
+    _bucket = _new_bucket(SHEETS_QUOTA_PER_MINUTE / max(1, processes))
+
+# 目前執行緒是否為背景寫入
+_priority = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,          # 實際送出的請求
+    "waited": 0,         # 需要等待額度的請求
+    "wait_seconds": 0.0,
+    "throttled": 0,      # 收到 429 的次數
+    "retries": 0,
+    "failures": 0,       # 等不到額度或重試用盡
+}
+
+
+@contextmanager
+def background():
+    """with 區塊內的工作表操作視為背景寫入（讓互動請求優先）"""
+    previous = getattr(_priority, "background", False)
+    _priority.background = True
+    try:
+        yield
+    finally:
+        _priority.background = previous
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def status_code(exc):
+    """取得例外的 HTTP 狀態碼（gspread APIError 的 code，或 response.status_code）"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code > 0:
+        return code
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _backoff(attempt):
+    """第 attempt 次重試前的等待秒數（full jitter）"""
+    return random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * (2 ** attempt)))
+
+
+def call(func, *args, idempotent=True, **kwargs):
+    """在配額內呼叫 func，429/5xx 時退避重試
+
+    互動請求（預設）最多等待 SHEETS_INTERACTIVE_TIMEOUT 秒（含退避），
+    背景寫入沒有期限，最多重試 SHEETS_MAX_RETRIES 次。
+    """
+    is_background = getattr(_priority, "background", False)
+    deadline = None if is_background else time.monotonic() + SHEETS_INTERACTIVE_TIMEOUT
+    operation = getattr(func, "__name__", "unknown")
+
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        waited = _bucket.acquire(background=is_background, deadline=deadline)
+        if waited is None:
+            _count("failures")
+            metrics.SHEETS_REQUESTS.inc(operation, "quota_timeout")
+            raise SheetsThrottled("等待 Google Sheets 配額逾時")
+        if waited > 0:
+            _count("waited")
+            _count("wait_seconds", waited)
+
+        _count("calls")
+        span = tracing.start_span(f"sheets.{operation}", attempt=attempt, quota_wait_ms=round(waited * 1000, 1))
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            code = status_code(e)
+            metrics.SHEETS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation)
+            metrics.SHEETS_REQUESTS.inc(operation, str(code) if code else "error")
+            tracing.finish_span(span, str(code) if code else type(e).__name__)
+            if code == 429:
+                _count("throttled")
+                _bucket.drain()
+            elif code is None or code < 500 or not idempotent:
+                raise
+            if attempt == SHEETS_MAX_RETRIES:
+                _count("failures")
+                raise
+
+            delay = _backoff(attempt)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                _count("failures")
+                raise
+            _count("retries")
+            time.sleep(delay)
+        else:
+            metrics.SHEETS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation)
+            metrics.SHEETS_REQUESTS.inc(operation, "ok")
+            tracing.finish_span(span)
+            return result
+
+
+class ThrottledWorksheet:
+    """包裝 gspread Worksheet：每個方法呼叫都經過 call()"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        idempotent = name not in NON_IDEMPOTENT
+
+        def governed(*args, **kwargs):
+            return call(attr, *args, idempotent=idempotent, **kwargs)
+
+        return governed
+
+
+def stats():
+    """配額控管的計數"""
+    with _stats_lock:
+        return dict(_stats)
@@ -1,149 +1,215 @@
-from questions import QUESTIONS, MAX_SCORE, MIN_SCORE
+import threading
 
-# 用戶測試狀態儲存
-user_sessions = {}
+import metrics
+from questions import (
+    QUESTIONS,
+    COMPILED_QUESTIONS,
+    COMPLETION_KEYWORDS,
+    LEVEL_BY_SCORE,
+    MAX_SCORE,
+    match_option,
+)
+from session_store import create_session_store
 
 
+class SessionState:
+    """精簡的測試狀態
+
+    answers 每題一個 byte：單選題存選項索引，多選題存已選選項的位元遮罩；
+    非計分題的 profile 在 get_result 時才由 answers 推算。
+    序列化後只有 3 + 題數 個 byte。
+    """
+
+    __slots__ = ("current_question", "score", "multi_mask", "answers")
+
+    def __init__(self, current_question=0, score=0, multi_mask=0, answers=None):
+        self.current_question = current_question
+        self.score = score
+        self.multi_mask = multi_mask  # 目前多選題的暫存選擇
+        self.answers = answers if answers is not None else bytearray(len(QUESTIONS))
+
+    def to_bytes(self):
+        """序列化為 bytes（供外部 session 儲存使用）"""
+        return bytes((self.current_question, self.score, self.multi_mask)) + bytes(self.answers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """由 to_bytes 的結果還原"""
+        return cls(data[0], data[1], data[2], bytearray(data[3:]))
+
+
+# 用戶測試狀態儲存（依 SESSION_BACKEND 選擇 memory 或 sqlite）
+_store = create_session_store(encode=SessionState.to_bytes, decode=SessionState.from_bytes)
+
+# 分段鎖：同一用戶的狀態變更依序執行，不同用戶大多落在不同的鎖上
+_LOCK_STRIPES = 64
+_user_locks = tuple(threading.Lock() for _ in range(_LOCK_STRIPES))
+
+
+def _user_lock(user_id):
+    """取得用戶對應的鎖"""
+    return _user_locks[hash(user_id) % _LOCK_STRIPES]
+
+
+def get_session(user_id):
+    """取得用戶目前的測試狀態"""
+    return _store.get(user_id)
+
+
+@metrics.timed()
 def start_test(user_id):
     """開始新的測試，初始化用戶狀態"""
-    user_sessions[user_id] = {
-        "current_question": 0,
-        "answers": [],
-        "score": 0,
-        "profile": {},  # 儲存非計分題的回答
-        "multi_answers": []  # 多選題暫存
-    }
+    with _user_lock(user_id):
+        _store.set(user_id, SessionState())
     return get_current_question(user_id)
 
 
 def get_current_question(user_id):
     """取得目前的題目"""
-    session = user_sessions.get(user_id)
+    session = _store.get(user_id)
     if not session:
         return None
 
-    question_index = session["current_question"]
+    question_index = session.current_question
     if question_index >= len(QUESTIONS):
         return None
 
     return QUESTIONS[question_index]
 
 
+def get_current_question_index(user_id):
+    """取得目前題目的索引，沒有進行中的測試回傳 None"""
+    session = _store.get(user_id)
+    if not session or session.current_question >= len(QUESTIONS):
+        return None
+    return session.current_question
+
+
+@metrics.timed()
 def process_answer(user_id, answer):
-    """處理用戶回答，回傳下一題或測試結果"""
-    session = user_sessions.get(user_id)
-    if not session:
-        return None, None
+    """處理用戶回答，回傳下一題或測試結果
+
+    同一 process 內以分段鎖序列化同一用戶的回答；跨 process（sqlite）時
+    以版本號 compare-and-set 寫回，版本已被其他 worker 更新就重讀後重算。
+    """
+    with _user_lock(user_id):
+        while True:
+            session, version = _store.get_versioned(user_id)
+            if not session:
+                return None, None
+
+            status, data, action = _apply_answer(session, answer)
+            if action == "set":
+                saved = _store.compare_and_set(user_id, session, version)
+            elif action == "delete":
+                saved = _store.delete(user_id, version)
+            else:
+                return status, data
+
+            if saved:
+                return status, data
+
+
+def _apply_answer(session, answer):
+    """將回答套用到 session，回傳 (狀態, 資料, 寫回方式)
 
-    current_question = QUESTIONS[session["current_question"]]
-    question_type = current_question.get("type", "single")
-    is_scored = current_question.get("scored", True)
+    寫回方式為 "set"、"delete" 或 None（不需寫回）。
+    """
+    compiled = COMPILED_QUESTIONS[session.current_question]
+    current_question = compiled.question
 
     # 處理多選題的「完成選擇」
-    if question_type == "multiple" and answer.strip() in ["完成", "完成選擇", "OK", "ok", "下一題", "好了", "確定"]:
+    if compiled.is_multiple and answer.strip() in COMPLETION_KEYWORDS:
         # 檢查是否至少選擇了一個選項
-        if not session.get("multi_answers"):
-            return "need_selection", current_question
-
-        # 儲存多選答案到 profile
-        question_key = f"Q{session['current_question'] + 1}"
-        session["profile"][question_key] = session.get("multi_answers", [])
-        session["answers"].append(session.get("multi_answers", []))
-        session["multi_answers"] = []
-
-        session["current_question"] += 1
-        if session["current_question"] >= len(QUESTIONS):
-            result = get_result(user_id)
-            del user_sessions[user_id]
-            return "complete", result
-        return "next", get_current_question(user_id)
-
-    # 解析答案 (A, B, C, D)
-    answer_map = {"A": 0, "B": 1, "C": 2, "D": 3}
-    answer_upper = answer.upper().strip()
-
-    # 取得選項索引
-    option_index = None
-    if answer_upper in answer_map:
-        option_index = answer_map[answer_upper]
-    elif len(answer_upper) >= 1 and answer_upper[0] in answer_map:
-        option_index = answer_map[answer_upper[0]]
-    else:
-        # 嘗試匹配完整選項文字
-        for i, opt in enumerate(current_question["options"]):
-            if answer in opt["label"]:
-                option_index = i
-                break
+        if not session.multi_mask:
+            return "need_selection", _current_state(session), None
 
-    if option_index is None:
-        return "invalid", None
+        # 儲存多選答案（profile 在產生結果時才展開）
+        session.answers[session.current_question] = session.multi_mask
+        session.multi_mask = 0
 
-    # 檢查選項索引是否有效
-    if option_index >= len(current_question["options"]):
-        return "invalid", None
+        session.current_question += 1
+        if session.current_question >= len(QUESTIONS):
+            return "complete", _build_result(session), "delete"
+        return "next", _next_question(session), "set"
 
-    selected_option = current_question["options"][option_index]
+    # 解析答案（選項代號 A, B, C, D 或選項文字）
+    option_index = match_option(compiled, answer)
+    if option_index is None:
+        return "invalid", _current_state(session), None
 
     # 處理多選題（支援 toggle：再點一次取消選擇）
-    if question_type == "multiple":
-        value = selected_option.get("value", selected_option["label"])
-        if value in session["multi_answers"]:
-            # 已選擇 -> 取消選擇
-            session["multi_answers"].remove(value)
-        else:
-            # 未選擇 -> 加入選擇
-            session["multi_answers"].append(value)
+    if compiled.is_multiple:
+        session.multi_mask ^= 1 << option_index
 
         return "multiple_continue", {
-            "selected": session["multi_answers"],
-            "question": current_question
-        }
+            "selected": list(compiled.selections[session.multi_mask]),
+            "question": current_question,
+            "index": compiled.index,
+            "mask": session.multi_mask
+        }, "set"
 
     # 處理單選題
-    answer_key = answer_upper[0] if len(answer_upper) > 0 else answer
-    session["answers"].append(answer_key)
+    session.answers[session.current_question] = option_index
 
-    # 計分題加分
-    if is_scored:
-        session["score"] += selected_option.get("score", 0)
-    else:
-        # 非計分題記錄到 profile
-        question_key = f"Q{session['current_question'] + 1}"
-        session["profile"][question_key] = selected_option.get("value", selected_option["label"])
+    # 計分題加分（非計分題的 profile 在產生結果時才展開）
+    if compiled.scored:
+        session.score += compiled.scores[option_index]
 
-    session["current_question"] += 1
+    session.current_question += 1
 
     # 檢查是否完成所有題目
-    if session["current_question"] >= len(QUESTIONS):
-        result = get_result(user_id)
-        del user_sessions[user_id]
-        return "complete", result
+    if session.current_question >= len(QUESTIONS):
+        return "complete", _build_result(session), "delete"
+
+    return "next", _next_question(session), "set"
+
+
+def _current_state(session):
+    """"need_selection" / "invalid" 的資料：目前的題目、索引與多選勾選（呼叫端不必再讀取 session）"""
+    return {
+        "question": QUESTIONS[session.current_question],
+        "index": session.current_question,
+        "mask": session.multi_mask,
+    }
+
 
-    return "next", get_current_question(user_id)
+def _next_question(session):
+    """"next" 的資料：下一題與其索引（與寫回的 session 一致，呼叫端不必再讀取 session）"""
+    return {
+        "question": QUESTIONS[session.current_question],
+        "index": session.current_question,
+    }
 
 
 def get_result(user_id):
     """根據分數產生測試結果"""
-    session = user_sessions.get(user_id)
+    session = _store.get(user_id)
     if not session:
         return None
+    return _build_result(session)
+
 
-    score = session["score"]
-    profile = session.get("profile", {})
-
-    # 評分等級（分數範圍 5-42）
-    if score >= 29:
-        level = "🟢【綠色穩健】財富方舟族"
-        description = "您已經具備基礎的財富配置架構。"
-        suggestion = "下一階段應關注「資產傳承」與「極致避險」，優化您的實體資產比例。"
-    elif score >= 16:
-        level = "🟡【黃色轉型】財富焦慮族"
-        description = "您有一定的理財意識，但工具過於單一（可能只有存款或股票）。在動盪時期，您的資產波動會讓您睡不著覺。"
-        suggestion = "建議導入「自動化配置工具」，平衡風險與收益。"
-    else:
-        level = "🔴【紅色警戒】財富裸奔族"
-        description = "您的財富極度缺乏防火牆，一旦通膨加速或收入中斷，生活品質會迅速滑落。"
-        suggestion = "您目前最需要的是建立「緊急防禦資產」，先學會鎖住財富價值。"
+def _build_profile(session):
+    """由已作答的答案推算非計分題的回答"""
+    profile = {}
+    for compiled in COMPILED_QUESTIONS[:session.current_question]:
+        if compiled.scored:
+            continue
+
+        answer = session.answers[compiled.index]
+        question_key = f"Q{compiled.index + 1}"
+        if compiled.is_multiple:
+            profile[question_key] = list(compiled.selections[answer])
+        else:
+            profile[question_key] = compiled.values[answer]
+    return profile
+
+
+def _build_result(session):
+    """由測試狀態計算結果"""
+    score = session.score
+    level, description, suggestion = LEVEL_BY_SCORE[score]
 
     return {
         "score": score,
@@ -151,39 +217,55 @@ def get_result(user_id):
         "level": level,
         "description": description,
         "suggestion": suggestion,
-        "profile": profile
+        "profile": _build_profile(session)
     }
 
 
 def is_user_in_test(user_id):
     """檢查用戶是否正在進行測試"""
-    return user_id in user_sessions
+    return user_id in _store
 
 
 def is_multiple_choice_question(user_id):
     """檢查目前是否為多選題"""
-    session = user_sessions.get(user_id)
+    session = _store.get(user_id)
     if not session:
         return False
 
-    question_index = session["current_question"]
+    question_index = session.current_question
     if question_index >= len(QUESTIONS):
         return False
 
-    return QUESTIONS[question_index].get("type") == "multiple"
+    return COMPILED_QUESTIONS[question_index].is_multiple
 
 
 def get_multiple_selections(user_id):
     """取得目前多選題已選擇的選項"""
-    session = user_sessions.get(user_id)
+    session = _store.get(user_id)
     if not session:
         return []
-    return session.get("multi_answers", [])
+
+    question_index = session.current_question
+    if question_index >= len(QUESTIONS) or not COMPILED_QUESTIONS[question_index].is_multiple:
+        return []
+    return list(COMPILED_QUESTIONS[question_index].selections[session.multi_mask])
 
 
+def get_multiple_mask(user_id):
+    """取得目前多選題已選擇選項的位元遮罩"""
+    session = _store.get(user_id)
+    if not session:
+        return 0
+    return session.multi_mask
+
+
+@metrics.timed()
 def cancel_test(user_id):
     """取消用戶的測試"""
-    if user_id in user_sessions:
-        del user_sessions[user_id]
-        return True
-    return False
+    with _user_lock(user_id):
+        return _store.delete(user_id)
+
+
+def get_session_stats():
+    """測試進度儲存的筆數與淘汰次數"""
+    return _store.stats()
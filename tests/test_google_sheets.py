@@ -0,0 +1,64 @@
+"""google_sheets 寫入工作表的格式（以 fake_sheets 取代 Google Sheets）
+
+執行：python -m pytest tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google_sheets  # noqa: E402
+from fake_sheets import FakeWorksheet, make_rows  # noqa: E402
+
+
+class RecordingWorksheet(FakeWorksheet):
+    """記錄每次 batch_update 的範圍與 value_input_option"""
+
+    def __init__(self, rows):
+        super().__init__(rows, latency=0, jitter=0, error_rate=0, quota_per_minute=0)
+        self.updates = []
+
+    def batch_update(self, data, **kwargs):
+        self.updates.append((kwargs.get("value_input_option"), [item["range"] for item in data]))
+        return super().batch_update(data, **kwargs)
+
+
+class ValueInputOptionTest(unittest.TestCase):
+    def setUp(self):
+        self.sheet = RecordingWorksheet(make_rows(3))
+        self.user_id = self.sheet._rows[2][0]
+        google_sheets._sheet = self.sheet
+        # 索引未載入時以 find 定位；不啟動背景載入
+        google_sheets._user_table = None
+        patcher = mock.patch.object(google_sheets, "_ensure_refresher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        google_sheets._sheet = None
+
+    def test_times_and_scores_are_user_entered(self):
+        written = google_sheets.batch_update_users({self.user_id: {
+            "score": 30, "level": "綠燈", "test_time": "2026/01/02 10:00",
+        }})
+        self.assertEqual(written, {self.user_id})
+        self.assertEqual(self.sheet.updates, [
+            ("USER_ENTERED", ["D3", "F3"]),
+            ("RAW", ["E3"]),
+        ])
+
+    def test_name_is_raw(self):
+        google_sheets.batch_update_users({self.user_id: {
+            "name": "=HYPERLINK(\"x\")", "register_time": "2026/01/02 10:00", "status": "待追蹤",
+        }})
+        self.assertEqual(self.sheet.updates, [
+            ("USER_ENTERED", ["C3"]),
+            ("RAW", ["B3", "G3"]),
+        ])
+        self.assertEqual(self.sheet._rows[2][1], "=HYPERLINK(\"x\")")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+"""請求追蹤（TRACING_ENABLED=1）
+
+每個 LINE 事件一個 trace，底下的 span 包含每個 google_sheets 函式與每次 Google Sheets
+API 請求、測試進度的變更與 reply_message（metrics.timed 記錄的階段都會同時成為 span）。
+trace 標記雜湊後的 user_id 與事件類型，結束時以 Zipkin v2 JSON 寫入輪替的本地檔案，
+每行是一個 trace 的 span 陣列，可以直接 POST 到 Zipkin 的 /api/v2/spans。
+
+沒有進行中的 trace 時（未啟用、未抽樣或背景執行緒），span 相關函式只檢查一次 thread-local。
+
+重建一位用戶的流程：python tracing.py <user_id 或雜湊> [追蹤檔]
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from config import (
+    TRACING_ENABLED,
+    TRACING_SAMPLE_RATE,
+    TRACING_FILE,
+    TRACING_FILE_MAX_BYTES,
+    TRACING_FILE_BACKUPS,
+    TRACING_SERVICE_NAME,
+    TRACING_USER_SALT,
+)
+
+_local = threading.local()
+_exporter = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+
+def hash_user_id(user_id):
+    """追蹤檔中代表用戶的 16 碼雜湊"""
+    return hashlib.sha256((TRACING_USER_SALT + user_id).encode("utf-8")).hexdigest()[:16]
+
+
+class Span:
+    """一段處理；時間戳記為 epoch 微秒（Zipkin 格式）"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "tags", "timestamp", "_started", "duration")
+
+    def __init__(self, trace_id, name, parent_id=None, tags=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.tags = tags or {}
+        self.timestamp = int(time.time() * 1_000_000)
+        self._started = time.perf_counter()
+        self.duration = 0
+
+    def finish(self, error=None):
+        self.duration = max(1, int((time.perf_counter() - self._started) * 1_000_000))
+        if error is not None:
+            self.tags["error"] = error
+
+    def to_zipkin(self):
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "localEndpoint": {"serviceName": TRACING_SERVICE_NAME},
+            "tags": {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        return span
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "stack")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []   # 已結束的 span
+        self.stack = []   # 進行中的 span（最後一個為目前的 span）
+
+
+def _get_exporter():
+    """第一次寫入時才開檔（fork 後的 worker 各自重新開檔，TRACING_FILE 可含 {pid}）"""
+    global _exporter, _exporter_pid
+    if _exporter is not None and _exporter_pid == os.getpid():
+        return _exporter
+    with _exporter_lock:
+        if _exporter is None or _exporter_pid != os.getpid():
+            handler = RotatingFileHandler(
+                TRACING_FILE.format(pid=os.getpid()),
+                maxBytes=TRACING_FILE_MAX_BYTES,
+                backupCount=TRACING_FILE_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"{__name__}.export.{os.getpid()}")
+            logger.handlers = [handler]
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _exporter = logger
+            _exporter_pid = os.getpid()
+    return _exporter
+
+
+def _export(trace):
+    try:
+        line = json.dumps([span.to_zipkin() for span in trace.spans], ensure_ascii=False)
+        _get_exporter().info(line)
+    except Exception as e:
+        print(f"寫入追蹤檔錯誤: {e}")
+
+
+def start_span(name, **tags):
+    """在目前的 trace 下開始一個 span；沒有進行中的 trace 時回傳 None"""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return None
+    parent = trace.stack[-1] if trace.stack else None
+    span = Span(trace.trace_id, name, parent.span_id if parent else None, tags)
+    trace.stack.append(span)
+    return span
+
+
+def finish_span(span, error=None):
+    """結束 start_span 回傳的 span（None 時不做事）"""
+    if span is None:
+        return
+    span.finish(error)
+    trace = getattr(_local, "trace", None)
+    if trace is None or trace.trace_id != span.trace_id:
+        return
+    if span in trace.stack:
+        trace.stack.remove(span)
+    trace.spans.append(span)
+
+
+def set_tag(key, value):
+    """在目前的 span 加上標籤"""
+    trace = getattr(_local, "trace", None)
+    if trace is not None and trace.stack:
+        trace.stack[-1].tags[key] = value
+
+
+@contextmanager
+def span(name, **tags):
+    """with 區塊成為目前 trace 的一個 span"""
+    current = start_span(name, **tags)
+    try:
+        yield current
+    except Exception as e:
+        finish_span(current, type(e).__name__)
+        raise
+    else:
+        finish_span(current)
+
+
+@contextmanager
+def trace_event(event):
+    """以一個 LINE 事件為 trace 的起點（已在 trace 中時只是一個 span）"""
+    if getattr(_local, "trace", None) is not None:
+        with span(f"line.{event.type}"):
+            yield
+        return
+    if not TRACING_ENABLED or (TRACING_SAMPLE_RATE < 1.0 and random.random() >= TRACING_SAMPLE_RATE):
+        yield
+        return
+
+    user_id = getattr(event.source, "user_id", None)
+    tags = {"event.type": event.type}
+    if user_id:
+        tags["user"] = hash_user_id(user_id)
+    if getattr(event, "webhook_event_id", None):
+        tags["webhook_event_id"] = event.webhook_event_id
+
+    trace = _Trace(f"{random.getrandbits(128):032x}")
+    _local.trace = trace
+    root = start_span(f"line.{event.type}", **tags)
+    try:
+        yield
+    except Exception as e:
+        finish_span(root, type(e).__name__)
+        raise
+    else:
+        finish_span(root)
+    finally:
+        _local.trace = None
+        _export(trace)
+
+
+def journey(user, paths):
+    """從追蹤檔找出某位用戶的所有 trace，依時間排序"""
+    user_hash = user if len(user) == 16 else hash_user_id(user)
+    traces = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                spans = json.loads(line)
+                root = next((s for s in spans if "parentId" not in s), None)
+                if root is not None and root["tags"].get("user") == user_hash:
+                    traces.append((root, spans))
+    traces.sort(key=lambda item: item[0]["timestamp"])
+    return traces
+
+
+def _print_journey(user, path):
+    paths = [f"{path}.{n}" for n in range(TRACING_FILE_BACKUPS, 0, -1)] + [path]
+    for root, spans in journey(user, paths):
+        started = time.strftime("%H:%M:%S", time.localtime(root["timestamp"] / 1_000_000))
+        print(f"{started}  {root['name']:<16} {root['duration'] / 1000:8.1f} ms  trace {root['traceId']}")
+        children = {}
+        for item in spans:
+            children.setdefault(item.get("parentId"), []).append(item)
+
+        def show(parent_id, depth):
+            for item in sorted(children.get(parent_id, ()), key=lambda s: s["timestamp"]):
+                offset = (item["timestamp"] - root["timestamp"]) / 1000
+                error = f"  [{item['tags']['error']}]" if "error" in item["tags"] else ""
+                print(f"{'':10}{'  ' * depth}+{offset:7.1f} ms  {item['name']:<48}"
+                      f"{item['duration'] / 1000:8.1f} ms{error}")
+                show(item["id"], depth + 1)
+
+        show(root["id"], 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("用法：python tracing.py <user_id 或雜湊> [追蹤檔]")
+    _print_journey(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else TRACING_FILE.format(pid=os.getpid()))
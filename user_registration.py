@@ -1,48 +1,155 @@
 """用戶註冊管理（使用 Google Sheets 持久化）"""
 
+import threading
+from contextlib import contextmanager
+
+import metrics
 from google_sheets import (
     start_registration_persistent,
     get_registration_state_persistent,
     update_registration_name,
     complete_registration_persistent,
     get_user_name,
+    get_user_by_id,
+    update_user_fields,
+    registration_state,
+    get_tw_time,
 )
 
+# 單一 webhook 事件的用戶資料快照（每個執行緒各自一份）
+_event_context = threading.local()
+
+_NOT_LOADED = object()
+
+
+class UserContext:
+    """單一事件內的用戶資料：第一次用到時讀取一次，多個欄位的寫入由 flush() 合併為一次請求"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._record = _NOT_LOADED
+        self.pending = {}
+
+    @property
+    def loaded(self):
+        return self._record is not _NOT_LOADED
+
+    @property
+    def record(self):
+        if self._record is _NOT_LOADED:
+            self._record = get_user_by_id(self.user_id)
+        return self._record
+
+    @record.setter
+    def record(self, value):
+        self._record = value
+
+    def update(self, fields):
+        """更新快照並記錄待寫入的欄位"""
+        if self.record is not None:
+            self.record.update(fields)
+        self.pending.update(fields)
+
+    def flush(self):
+        """將累積的寫入一次送出（必須在回覆 LINE 之前呼叫），回傳是否成功"""
+        if not self.pending:
+            return True
+        fields, self.pending = self.pending, {}
+        return update_user_fields(self.user_id, fields)
+
 
+@contextmanager
+def user_context(user_id):
+    """在 with 區塊內，同一用戶的註冊查詢共用快照"""
+    previous = getattr(_event_context, "current", None)
+    context = UserContext(user_id)
+    _event_context.current = context
+    try:
+        yield context
+    finally:
+        _event_context.current = previous
+
+
+def _get_context(user_id):
+    """取得目前事件的用戶資料（非同一用戶則回傳 None）"""
+    context = getattr(_event_context, "current", None)
+    if context is not None and context.user_id == user_id:
+        return context
+    return None
+
+
+def _get_state(user_id):
+    """取得註冊狀態，事件內優先使用快照"""
+    context = _get_context(user_id)
+    if context is not None:
+        return registration_state(context.record)
+    return get_registration_state_persistent(user_id)
+
+
+@metrics.timed()
 def is_user_registered(user_id):
     """檢查用戶是否已完成註冊"""
-    state = get_registration_state_persistent(user_id)
+    state = _get_state(user_id)
     return state == "completed"
 
 
+@metrics.timed()
 def is_user_in_registration(user_id):
     """檢查用戶是否正在註冊中"""
-    state = get_registration_state_persistent(user_id)
+    state = _get_state(user_id)
     return state == "waiting_name"
 
 
+@metrics.timed()
 def start_registration(user_id):
     """開始註冊流程"""
+    context = _get_context(user_id)
+    if context is not None and context.loaded and context.record is not None:
+        # 已讀取過記錄，不需要再查詢 Google Sheets
+        if context.record["register_time"]:
+            return "already_registered"
+        return "waiting_name"
+
     result = start_registration_persistent(user_id)
     if result == "already_registered":
         return "already_registered"
+    if context is not None:
+        # 已新建記錄，之後用到時再重新讀取
+        context.record = _NOT_LOADED
     return "waiting_name"
 
 
+@metrics.timed()
 def get_registration_state(user_id):
     """取得註冊狀態"""
-    return get_registration_state_persistent(user_id)
+    return _get_state(user_id)
 
 
+@metrics.timed()
 def process_registration(user_id, message):
     """處理註冊輸入"""
-    state = get_registration_state_persistent(user_id)
+    state = _get_state(user_id)
     if not state or state == "completed":
         return None, None
 
     if state == "waiting_name":
         # 儲存姓名並直接完成註冊
         name = message.strip()
+
+        context = _get_context(user_id)
+        if context is not None:
+            # 姓名與完成註冊合併為一次寫入，回覆前送出，其他 worker 立即看得到
+            context.update({
+                "name": name,
+                "register_time": get_tw_time(),
+                "status": "待追蹤",
+            })
+            if not context.flush():
+                # 寫入失敗，快照已不可信
+                context.record = _NOT_LOADED
+                return None, None
+            return "completed", {"name": name}
+
         if update_registration_name(user_id, name):
             # 直接完成註冊（不需要匯款碼）
             result = complete_registration_persistent(user_id, "")
@@ -53,7 +160,10 @@ def process_registration(user_id, message):
     return None, None
 
 
+@metrics.timed()
 def get_user_info(user_id):
     """取得用戶資料"""
-    from google_sheets import get_user_by_id
+    context = _get_context(user_id)
+    if context is not None:
+        return context.record
     return get_user_by_id(user_id)
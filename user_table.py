@@ -0,0 +1,94 @@
+"""欄式用戶表（Google Sheets CRM 的記憶體索引）
+
+每個欄位一個 list，user_id 對應到槽位；比每位用戶一個 list 省下大量物件開銷。
+重複值多的欄位（分數、等級、狀態）共用同一個字串物件。
+"""
+from array import array
+
+
+class UserTable:
+    """user_id -> 槽位；列號 0 代表新增的列還沒寫入工作表"""
+
+    def __init__(self, width, shared_columns=()):
+        self.width = width
+        self.columns = [[] for _ in range(width)]
+        self.row_numbers = array("L")
+        self._slots = {}
+        self._free = []
+        self._shared = {column: {} for column in shared_columns}
+
+    def _value(self, column, row):
+        value = row[column] if column < len(row) else ""
+        shared = self._shared.get(column)
+        if shared is None:
+            return value
+        return shared.setdefault(value, value)
+
+    def add(self, user_id, row_number, row):
+        """新增一列，回傳是否為新用戶
+
+        已存在時保留原本的資料（與 sheet.find 一致以最早的列為準），只補上未知的列號。
+        """
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            if not self.row_numbers[slot] and row_number:
+                self.row_numbers[slot] = row_number
+            return False
+
+        if self._free:
+            slot = self._free.pop()
+            for column, values in enumerate(self.columns):
+                values[slot] = self._value(column, row)
+            self.row_numbers[slot] = row_number or 0
+        else:
+            slot = len(self.row_numbers)
+            for column, values in enumerate(self.columns):
+                values.append(self._value(column, row))
+            self.row_numbers.append(row_number or 0)
+        self._slots[user_id] = slot
+        return True
+
+    def get(self, user_id):
+        """回傳 (列號, 列資料)，列號未知時為 None；找不到回傳 None"""
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return None
+        return self.row_numbers[slot] or None, [values[slot] for values in self.columns]
+
+    def set_row(self, user_id, row):
+        """以工作表重新讀取的資料取代整列"""
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return
+        for column, values in enumerate(self.columns):
+            values[slot] = self._value(column, row)
+
+    def set_cells(self, user_id, cells):
+        """更新部分欄位（cells: 欄索引 -> 值，從 0 開始）"""
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return
+        for column, value in cells.items():
+            shared = self._shared.get(column)
+            self.columns[column][slot] = value if shared is None else shared.setdefault(value, value)
+
+    def remove(self, user_id):
+        """移除用戶，槽位留給之後新增的用戶"""
+        slot = self._slots.pop(user_id, None)
+        if slot is None:
+            return
+        for values in self.columns:
+            values[slot] = ""
+        self.row_numbers[slot] = 0
+        self._free.append(slot)
+
+    def items(self):
+        """逐一回傳 (user_id, 列號, 列資料)"""
+        for user_id, slot in self._slots.items():
+            yield user_id, self.row_numbers[slot] or None, [values[slot] for values in self.columns]
+
+    def __contains__(self, user_id):
+        return user_id in self._slots
+
+    def __len__(self):
+        return len(self._slots)